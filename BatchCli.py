@@ -0,0 +1,282 @@
+# Command line batch mode of the Ramp and Roll simulator
+# Reads parameter sets as CSV or JSON lines (from a file or stdin) and streams the results as CSV or JSON lines.
+#   python MainControl.py --batch cases.csv --workers 4 > results.csv
+#   echo '{"theta": 20, "m": 0.5}' | python MainControl.py --batch - --output-format jsonl
+#   python MainControl.py --batch sweep.csv --archive runs/ > results.csv   (trajectories into TrajectoryArchive)
+import sys
+import csv
+import json
+import argparse
+import collections
+import concurrent.futures as cf
+import numpy as np
+import RampRoll as RampRoll
+import SweepRunner as SweepRunner
+import TrajectoryArchive as TrajectoryArchive
+
+RESULT_FIELDS = ('v_exit', 't_exit', 't_stop', 'distance', 'status')
+TRAJECTORY_FIELDS = ('case', 't', 'v', 's')
+
+
+def make_parser():
+
+    parser = argparse.ArgumentParser(prog='MainControl.py --batch',
+                                     description='Run Ramp and Roll parameter sets without the GUI.')
+    parser.add_argument('input', nargs='?', default='-',
+                        help='CSV or JSON lines file with columns %s, - for stdin'
+                             % ', '.join(RampRoll.BATCH_INPUTS))
+    parser.add_argument('-o', '--output', default='-', help='output file, - for stdout')
+    parser.add_argument('--input-format', choices=('auto', 'csv', 'jsonl'), default='auto')
+    parser.add_argument('--output-format', choices=('csv', 'jsonl'), default='csv')
+    parser.add_argument('--dt', type=float, default=None, help='simulation delta t (s)')
+    parser.add_argument('--floor-limit', type=float, default=None, help='floor limit (m)')
+    parser.add_argument('--method', choices=('analytic', 'step'), default='analytic',
+                        help='closed form solution or the per-dt scheme of RampRoll.run; trajectories '
+                             '(--trajectory, --archive) always need time steps, analytic then means the '
+                             'vectorized dt grid of RampRoll.run_vectorized')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='cases per block sent to a worker')
+    parser.add_argument('--trajectory', action='store_true',
+                        help='write the full (t, v, s) trajectory of every case instead of the summary')
+    parser.add_argument('--decimate', type=int, default=1, help='keep every n-th trajectory sample')
+    parser.add_argument('--archive', default=None,
+                        help='append the trajectory of every case to this TrajectoryArchive directory '
+                             '(run number = first new run + case number), the output gets the summary')
+    return parser
+
+
+# parameter dicts, one per input line, read lazily so stdin can be a pipe
+def read_records(stream, fmt='auto'):
+
+    if fmt == 'auto':
+        first = ''
+        for first in stream:
+            if first.strip():
+                break
+        fmt = 'jsonl' if first.lstrip().startswith('{') else 'csv'
+        stream = _chain([first], stream)
+
+    if fmt == 'jsonl':
+        for line in stream:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            # a broken line must not run as a default case, all nan inputs make it STATUS_ERROR
+            yield record if isinstance(record, dict) else {name: 'nan' for name in RampRoll.BATCH_INPUTS}
+    else:
+        for row in csv.DictReader(stream):
+            yield row
+
+
+def _chain(head, tail):
+    for line in head:
+        yield line
+    for line in tail:
+        yield line
+
+
+def _to_float(x, default: float) -> float:
+    if x is None or x == '':
+        return default
+    try:
+        return float(x)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+# nan / inf are not valid JSON, they are written as null like SimServer.case_record does
+def _json_float(x: float):
+    return x if np.isfinite(x) else None
+
+
+# group records into BATCH_DTYPE blocks, missing fields take the defaults of rr_obj
+def iter_case_blocks(records, rr_obj, chunk_size: int):
+
+    defaults = {'m': rr_obj.m, 'theta': rr_obj.theta, 'u_r': rr_obj.u_r, 'u_f': rr_obj.u_f,
+                'c': rr_obj.c, 'slope_length': 5.}
+    block = []
+    for record in records:
+        block.append(tuple(_to_float(record.get(name), defaults[name]) for name in RampRoll.BATCH_INPUTS))
+        if len(block) >= chunk_size:
+            yield _make_block(block)
+            block = []
+    if block:
+        yield _make_block(block)
+
+
+def _make_block(block):
+    values = np.array(block, dtype=float)
+    return RampRoll.batch_cases(*values.T)
+
+
+# worker for --trajectory: (t, v, s) per case, decimated, None when the case cannot run (with the reason
+# in cases['status'])
+def trajectory_chunk(cases, settings: dict, method='analytic', decimate=1):
+
+    rr = RampRoll.RampRoll()
+    for name, value in settings.items():
+        setattr(rr, name, value)
+    valid = SweepRunner.valid_inputs(cases)
+    trajectories = []
+    for i, case in enumerate(cases):
+        if not valid[i]:
+            cases['status'][i] = RampRoll.STATUS_ERROR
+            trajectories.append(None)
+            continue
+        rr.set_car_mass(case['m'])
+        rr.set_ramp_angle(case['theta'])
+        rr.set_ramp_friction_coeff(case['u_r'])
+        rr.set_floor_friction_coeff(case['u_f'])
+        rr.set_air_drag_coeff(case['c'])
+        try:
+            if method == 'step':
+                va, sa, ta = rr.run(case['slope_length'])
+            else:
+                va, sa, ta = rr.run_vectorized(case['slope_length'])
+        except RampRoll.NoSlideError:
+            cases['status'][i] = RampRoll.STATUS_NO_SLIDE
+            trajectories.append(None)
+            continue
+        except (ValueError, ZeroDivisionError, FloatingPointError):
+            cases['status'][i] = RampRoll.STATUS_ERROR
+            trajectories.append(None)
+            continue
+        if len(ta) == 0:
+            cases['status'][i] = RampRoll.STATUS_ERROR
+            trajectories.append(None)
+            continue
+        # every n-th sample, always keeping the final one
+        keep = np.arange(0, len(ta), decimate)
+        if keep[-1] != len(ta) - 1:
+            keep = np.append(keep, len(ta) - 1)
+        trajectories.append((np.asarray(ta)[keep], np.asarray(va)[keep], np.asarray(sa)[keep]))
+    return cases, trajectories
+
+
+# worker for --archive: the summary of run_chunk together with the trajectories
+def archive_chunk(cases, settings: dict, method='analytic', decimate=1):
+
+    cases = SweepRunner.run_chunk(cases, settings, method)
+    return trajectory_chunk(cases, settings, method, decimate)
+
+
+class ResultWriter:
+
+    def __init__(self, stream, fmt: str, trajectory: bool):
+
+        self.stream = stream
+        self.fmt = fmt
+        self.trajectory = trajectory
+        self.n_cases = 0
+        self.csv_writer = None
+        if fmt == 'csv':
+            self.csv_writer = csv.writer(stream)
+            if trajectory:
+                self.csv_writer.writerow(TRAJECTORY_FIELDS + ('status',))
+            else:
+                self.csv_writer.writerow(RampRoll.BATCH_INPUTS + RESULT_FIELDS + ('status_name',))
+
+    def write_summary(self, cases):
+
+        for case in cases:
+            status = int(case['status'])
+            row = [float(case[name]) for name in RampRoll.BATCH_INPUTS + RESULT_FIELDS[:-1]]
+            if self.fmt == 'csv':
+                self.csv_writer.writerow(['%.9g' % x for x in row] + [status, RampRoll.STATUS_NAMES[status]])
+            else:
+                record = {name: _json_float(x) for name, x in zip(RampRoll.BATCH_INPUTS + RESULT_FIELDS[:-1], row)}
+                record['status'] = status
+                record['status_name'] = RampRoll.STATUS_NAMES[status]
+                self.stream.write(json.dumps(record) + '\n')
+        self.n_cases = self.n_cases + len(cases)
+        self.stream.flush()
+
+    def write_trajectories(self, cases, trajectories):
+
+        for case, trajectory in zip(cases, trajectories):
+            i = self.n_cases
+            self.n_cases = self.n_cases + 1
+            if self.fmt == 'csv':
+                if trajectory is None:
+                    self.csv_writer.writerow([i, '', '', '', RampRoll.STATUS_NAMES[int(case['status'])]])
+                    continue
+                for t, v, s in zip(*trajectory):
+                    self.csv_writer.writerow([i, '%.9g' % t, '%.9g' % v, '%.9g' % s, ''])
+            else:
+                record = {name: _json_float(float(case[name])) for name in RampRoll.BATCH_INPUTS}
+                record['case'] = i
+                if trajectory is None:
+                    record['status_name'] = RampRoll.STATUS_NAMES[int(case['status'])]
+                else:
+                    record['t'], record['v'], record['s'] = [x.tolist() for x in trajectory]
+                self.stream.write(json.dumps(record) + '\n')
+        self.stream.flush()
+
+
+# Run blocks through the worker function, in input order, with a bounded number of blocks in flight.
+def iter_results(blocks, func, args, workers: int):
+
+    if workers <= 1:
+        for block in blocks:
+            yield func(block, *args)
+        return
+
+    with cf.ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = collections.deque()
+        for block in blocks:
+            pending.append(pool.submit(func, block, *args))
+            if len(pending) >= 2*workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def run_batch_cli(argv=None) -> int:
+
+    args = make_parser().parse_args(argv)
+
+    rr = RampRoll.RampRoll()
+    if args.dt is not None:
+        rr.set_sim_delta_t(args.dt)
+    if args.floor_limit is not None:
+        rr.set_floor_limit(args.floor_limit)
+    settings = {name: getattr(rr, name) for name in SweepRunner.SWEEP_SETTINGS}
+
+    in_stream = sys.stdin if args.input == '-' else open(args.input, newline='')
+    out_stream = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    try:
+        writer = ResultWriter(out_stream, args.output_format, args.trajectory)
+        blocks = iter_case_blocks(read_records(in_stream, args.input_format), rr, max(args.chunk_size, 1))
+        if args.archive:
+            with TrajectoryArchive.TrajectoryArchive(args.archive, 'a') as archive:
+                first = len(archive)
+                results = iter_results(blocks, archive_chunk,
+                                       (settings, args.method, max(args.decimate, 1)), args.workers)
+                for cases, trajectories in results:
+                    writer.write_summary(cases)
+                    for case, trajectory in zip(cases, trajectories):
+                        # failed cases are kept as empty runs so run numbers stay in step with the cases
+                        ta, va, sa = trajectory if trajectory is not None else ((), (), ())
+                        archive.append(ta, va, sa, {name: case[name] for name in RampRoll.BATCH_INPUTS},
+                                       case['status'])
+                print('Runs %d to %d appended to %s' % (first, len(archive) - 1, args.archive), file=sys.stderr)
+        elif args.trajectory:
+            results = iter_results(blocks, trajectory_chunk,
+                                   (settings, args.method, max(args.decimate, 1)), args.workers)
+            for cases, trajectories in results:
+                writer.write_trajectories(cases, trajectories)
+        else:
+            for cases in iter_results(blocks, SweepRunner.run_chunk, (settings, args.method), args.workers):
+                writer.write_summary(cases)
+    except BrokenPipeError:
+        # downstream of the pipe (e.g. head) stopped reading
+        return 0
+    finally:
+        if in_stream is not sys.stdin:
+            in_stream.close()
+        if out_stream is not sys.stdout:
+            out_stream.close()
+    return 0
@@ -0,0 +1,287 @@
+# Benchmarks for the Ramp and Roll simulator core
+# Speed (runs/sec, cost per step), peak memory and accuracy against a high resolution reference solution
+# over a matrix of dt, floor_limit and air drag settings; results are written to JSON.
+# The exit code is 1 when an engine misses its accuracy limit or, with --compare, got less accurate.
+#   python Benchmark.py --output bench.json
+#   python Benchmark.py --quick --compare bench.json
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import pathlib
+import tracemalloc
+
+# cold import of the headless core (numpy included) must stay under this budget
+IMPORT_BUDGET_MS = 200.
+# modules the core must not pull in
+GUI_MODULES = ('tkinter', 'matplotlib')
+
+BENCH_DT = (1e-3, 1e-4)
+BENCH_FLOOR_LIMIT = (10., 100.)
+BENCH_DRAG = (0., 0.002, 0.05)
+BENCH_ENGINES = ('run', 'run_vectorized', 'run_adaptive', 'solve')
+BENCH_SLOPE_LENGTH = 5.
+# --compare flags a case whose error grew by more than this factor (plus a tiny absolute slack)
+ERROR_GROWTH_LIMIT = 1.1
+# The reference is run_adaptive at a tight tolerance, which integrates the equations of motion and shares
+# no code with the closed form solve.
+REFERENCE_RTOL = 1e-12
+REFERENCE_ATOL = 1e-14
+REFERENCE_NAME = 'run_adaptive rtol=%g atol=%g' % (REFERENCE_RTOL, REFERENCE_ATOL)
+# Largest accepted final distance / stop time error against the reference: the time stepped engines are
+# first order, STEP_ERROR_LIMIT times dt; the others have a fixed limit (run_adaptive at its default rtol).
+STEPPED_ENGINES = ('run', 'run_vectorized')
+STEP_ERROR_LIMIT = 20.
+ENGINE_ERROR_LIMITS = {'run_adaptive': 1e-6, 'solve': 1e-9}
+
+
+def get_base_dir() -> str:
+    return str(pathlib.Path(__file__).parent.resolve())
+
+
+# Time a cold import of module_name in a fresh interpreter, best of repeat runs.
+# Returns the time in ms and the GUI modules that got imported along with it.
+def measure_import_time(module_name='RampRoll', repeat=5):
+
+    code = ('import sys, time, json\n'
+            't = time.perf_counter()\n'
+            'import %s\n'
+            't = (time.perf_counter() - t)*1000.\n'
+            'gui = sorted(m for m in sys.modules if m.split(".")[0] in %r)\n'
+            'print(json.dumps([t, gui]))\n' % (module_name, GUI_MODULES))
+    best = None
+    gui = []
+    for i in range(repeat):
+        out = subprocess.run([sys.executable, '-c', code], cwd=get_base_dir(),
+                             capture_output=True, text=True, check=True)
+        t, gui = json.loads(out.stdout)
+        best = t if best is None else min(best, t)
+    return best, gui
+
+
+def check_import_budget(module_name='RampRoll', budget_ms=IMPORT_BUDGET_MS) -> bool:
+
+    t, gui = measure_import_time(module_name)
+    ok = t <= budget_ms and not gui
+    print('import %s : %.1f ms (budget %.0f ms) %s' % (module_name, t, budget_ms, 'OK' if ok else 'FAIL'))
+    if gui:
+        print('  GUI modules imported: %s' % ', '.join(gui))
+    return ok
+
+
+# seconds per call of func, repeating until min_time has passed (best of 3 rounds)
+def time_call(func, min_time=0.2, max_calls=100000):
+
+    best = None
+    for r in range(3):
+        n = 0
+        t0 = time.perf_counter()
+        while True:
+            func()
+            n = n + 1
+            elapsed = time.perf_counter() - t0
+            if elapsed >= min_time/3. or n >= max_calls:
+                break
+        per_call = elapsed/n
+        best = per_call if best is None else min(best, per_call)
+    return best
+
+
+# peak Python heap allocation of one call (tracemalloc sees numpy buffers too), in bytes
+def peak_memory(func) -> int:
+
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+# the floor phase of RampRoll.run on its own, the energy subtraction loop from speed v
+def floor_loop(rr, v: float) -> int:
+
+    dt = rr.dt
+    s = 0.
+    n = 0
+    while v > 0:
+        k = rr.kinematic_energy(v)
+        w_friction = rr.friction_loss(v*dt, rr.u_f)
+        w_drag = rr.air_drag_loss(v, v*dt)
+        v = rr.get_velocity_from_kinematics(k - w_friction - w_drag)
+        s = s + (v*dt)
+        n = n + 1
+        if s > rr.floor_limit:
+            break
+    return n
+
+
+def bench_v_ramp(rr, quick: bool):
+
+    import numpy as np
+    import RampRoll as RampRoll
+    t = np.linspace(0., 2., 100000)
+    scalar = time_call(lambda: RampRoll.v_ramp(0.5, rr.c, rr.m, rr.theta, rr.u_r, rr.g),
+                       0.1 if quick else 0.3)
+    vector = time_call(lambda: RampRoll.v_ramp(t, rr.c, rr.m, rr.theta, rr.u_r, rr.g),
+                       0.1 if quick else 0.3)
+    return {'ns_per_scalar_call': scalar*1e9, 'ns_per_array_element': vector/len(t)*1e9}
+
+
+def bench_floor_loop(rr, quick: bool):
+
+    v0 = rr.solve(BENCH_SLOPE_LENGTH)['v_exit']
+    n = floor_loop(rr, v0)
+    per_run = time_call(lambda: floor_loop(rr, v0), 0.1 if quick else 0.3)
+    return {'dt': rr.dt, 'n_steps': n, 'sec_per_run': per_run, 'ns_per_step': per_run/max(n, 1)*1e9}
+
+
+def reference_solution(rr):
+
+    rtol, atol = rr.rtol, rr.atol
+    rr.rtol, rr.atol = REFERENCE_RTOL, REFERENCE_ATOL
+    try:
+        result = rr.run_adaptive(BENCH_SLOPE_LENGTH)
+    finally:
+        rr.rtol, rr.atol = rtol, atol
+    return {'distance': result.distance, 't_stop': result.t_stop}
+
+
+def error_limit(engine: str, dt: float) -> float:
+    return STEP_ERROR_LIMIT*dt if engine in STEPPED_ENGINES else ENGINE_ERROR_LIMITS[engine]
+
+
+# One engine for one setting: speed, memory and the error of the final distance / stop time
+# against the reference solution (see reference_solution) of the same continuous model.
+def bench_engine(rr, engine: str, quick: bool, reference: dict):
+
+    if engine == 'solve':
+        def func():
+            return rr.solve(BENCH_SLOPE_LENGTH)
+    else:
+        func = getattr(rr, engine)
+        func = (lambda f: lambda: f(BENCH_SLOPE_LENGTH))(func)
+
+    result = func()
+    if engine == 'solve':
+        distance, t_stop, n_steps = result['distance'], result['t_stop'], 1
+    else:
+        distance, t_stop, n_steps = result.distance, result.t_stop, result.n
+    per_run = time_call(func, 0.05 if quick else 0.2, max_calls=1000)
+    row = {'engine': engine, 'dt': rr.dt, 'floor_limit': rr.floor_limit, 'c': rr.c,
+           'runs_per_sec': 1./per_run, 'sec_per_run': per_run, 'n_steps': n_steps,
+           'ns_per_step': per_run/n_steps*1e9, 'peak_kib': peak_memory(func)/1024.,
+           'distance': distance, 'distance_error': abs(distance - reference['distance']),
+           't_stop_error': abs(t_stop - reference['t_stop']), 'error_limit': error_limit(engine, rr.dt)}
+    row['accurate'] = bool(max(row['distance_error'], row['t_stop_error']) <= row['error_limit'])
+    return row
+
+
+def bench_batch(rr, quick: bool):
+
+    import numpy as np
+    import RampRoll as RampRoll
+    n = 10**4 if quick else 10**5
+    rng = np.random.default_rng(0)
+    cases = RampRoll.batch_cases(rng.uniform(0.1, 2., n), rng.uniform(10., 60., n), 0.1, 0.1, 0.002,
+                                 BENCH_SLOPE_LENGTH)
+    per_batch = time_call(lambda: rr.solve_batch(cases.copy()), 0.1 if quick else 0.3, max_calls=100)
+    return {'n_cases': n, 'cases_per_sec': n/per_batch}
+
+
+def run_benchmarks(quick=False):
+
+    import numpy as np
+    import RampRoll as RampRoll
+
+    import_ms, gui = measure_import_time('RampRoll')
+    report = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+              'numpy': np.__version__, 'quick': quick, 'reference': REFERENCE_NAME,
+              'import': {'ms': import_ms, 'budget_ms': IMPORT_BUDGET_MS, 'gui_modules': gui}}
+
+    rr = RampRoll.RampRoll()
+    report['v_ramp'] = bench_v_ramp(rr, quick)
+    report['floor_loop'] = []
+    report['engines'] = []
+    dts = BENCH_DT[:1] if quick else BENCH_DT
+    limits = BENCH_FLOOR_LIMIT[-1:] if quick else BENCH_FLOOR_LIMIT
+    drags = BENCH_DRAG[1:2] if quick else BENCH_DRAG
+    for dt in dts:
+        rr.set_sim_delta_t(dt)
+        report['floor_loop'].append(bench_floor_loop(rr, quick))
+        for floor_limit in limits:
+            rr.set_floor_limit(floor_limit)
+            for c in drags:
+                rr.set_air_drag_coeff(c)
+                reference = reference_solution(rr)
+                for engine in BENCH_ENGINES:
+                    row = bench_engine(rr, engine, quick, reference)
+                    report['engines'].append(row)
+                    print('%-15s dt=%-7g limit=%-5g c=%-6g %10.1f runs/s %9.1f ns/step  err %.2e m %s'
+                          % (tuple(row[k] for k in ('engine', 'dt', 'floor_limit', 'c', 'runs_per_sec',
+                                                    'ns_per_step', 'distance_error'))
+                             + ('' if row['accurate'] else 'FAIL (limit %.1e)' % row['error_limit'],)))
+        rr.set_air_drag_coeff(0.002)
+        rr.set_floor_limit(100)
+    report['batch'] = bench_batch(rr, quick)
+    return report
+
+
+# Compare against an earlier report: speed ratios, and accuracy regressions for matching settings.
+# Errors are only compared when both reports used the same reference solution.
+# Returns the number of accuracy regressions.
+def compare_reports(old: dict, new: dict) -> int:
+
+    def key(row):
+        return row['engine'], row['dt'], row['floor_limit'], row['c']
+
+    same_reference = old.get('reference') == new.get('reference')
+    if not same_reference:
+        print('%s was measured against another reference, only speeds are compared' % old.get('timestamp'))
+    old_rows = {key(row): row for row in old.get('engines', [])}
+    regressions = 0
+    for row in new['engines']:
+        prev = old_rows.get(key(row))
+        if prev is None:
+            continue
+        speedup = row['runs_per_sec']/prev['runs_per_sec']
+        worse = [name for name in ('distance_error', 't_stop_error')
+                 if same_reference and row[name] > ERROR_GROWTH_LIMIT*prev[name] + 1e-12]
+        regressions = regressions + len(worse)
+        print('%-15s dt=%-7g limit=%-5g c=%-6g speed x%.2f %s'
+              % (key(row) + (speedup, 'ACCURACY REGRESSION: ' + ', '.join(worse) if worse else '')))
+    return regressions
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Ramp and Roll simulator benchmarks')
+    parser.add_argument('--quick', action='store_true', help='small matrix and short timings')
+    parser.add_argument('--output', default=None, help='write the report to this JSON file')
+    parser.add_argument('--compare', default=None, help='earlier JSON report to compare against')
+    parser.add_argument('--import-only', action='store_true', help='only check the import time budget')
+    args = parser.parse_args(argv)
+
+    ok = check_import_budget('RampRoll')
+    if args.import_only:
+        return 0 if ok else 1
+
+    report = run_benchmarks(args.quick)
+    failed = [row for row in report['engines'] if not row['accurate']]
+    if failed:
+        print('%d engine runs missed their accuracy limit' % len(failed))
+        ok = False
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            if compare_reports(json.load(f), report) > 0:
+                ok = False
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
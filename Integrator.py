@@ -0,0 +1,161 @@
+# Adaptive step integrator for the Ramp and Roll simulator
+# Dormand-Prince 5(4) with error control, cubic Hermite dense output and event location.
+import numpy as np
+
+# Dormand-Prince 5(4) tableau
+DP_C = np.array([0., 1./5, 3./10, 4./5, 8./9, 1., 1.])
+DP_A = [np.array([]),
+        np.array([1./5]),
+        np.array([3./40, 9./40]),
+        np.array([44./45, -56./15, 32./9]),
+        np.array([19372./6561, -25360./2187, 64448./6561, -212./729]),
+        np.array([9017./3168, -355./33, 46732./5247, 49./176, -5103./18656]),
+        np.array([35./384, 0., 500./1113, 125./192, -2187./6784, 11./84])]
+DP_B = DP_A[6]
+# difference between the 5th and the embedded 4th order weights
+DP_E = np.array([71./57600, 0., -71./16695, 71./1920, -17253./339200, 22./525, -1./40])
+
+
+# Event for integrate_adaptive: func(t, y) crosses zero.
+# direction = -1 / 1 only counts falling / rising crossings, 0 counts both.
+# A terminal event stops the integration at the crossing.
+class Event:
+
+    def __init__(self, func, direction=0, terminal=True, name=''):
+        self.func = func
+        self.direction = direction
+        self.terminal = terminal
+        self.name = name
+
+
+# one Dormand-Prince step, returns the 5th order solution, its error estimate and f at the end (FSAL)
+def dp_step(f, t, y, f0, h):
+
+    k = np.empty((7, len(y)))
+    k[0] = f0
+    for i in range(1, 7):
+        k[i] = f(t + DP_C[i]*h, y + h*np.dot(DP_A[i], k[:i]))
+    y_new = y + h*np.dot(DP_B, k[:6])
+    err = h*np.dot(DP_E, k)
+    return y_new, err, k[6]
+
+
+# cubic Hermite interpolation inside an accepted step [t0, t0 + h]
+def hermite(t, t0, h, y0, y1, f0, f1):
+
+    x = (t - t0)/h
+    h00 = (1. + 2.*x)*(1. - x)**2
+    h10 = x*(1. - x)**2
+    h01 = x*x*(3. - 2.*x)
+    h11 = x*x*(x - 1.)
+    return h00*y0 + h*h10*f0 + h01*y1 + h*h11*f1
+
+
+# root of func in [a, b] with func(a), func(b) of opposite sign (Illinois variant of regula falsi)
+def find_root(func, a: float, b: float, fa: float, fb: float, xtol=1e-14, max_iter=100):
+
+    side = 0
+    for i in range(max_iter):
+        if fa == fb:
+            break
+        c = (a*fb - b*fa)/(fb - fa)
+        fc = func(c)
+        if abs(b - a) <= xtol*max(1., abs(c)) or fc == 0.:
+            return c
+        if (fc > 0.) == (fb > 0.):
+            b, fb = c, fc
+            if side == -1:
+                fa = 0.5*fa
+            side = -1
+        else:
+            a, fa = c, fc
+            if side == 1:
+                fb = 0.5*fb
+            side = 1
+    return 0.5*(a + b)
+
+
+# Integrate dy/dt = f(t, y) from t0 until t_end or a terminal event.
+# Returns the accepted times, the states (one row per time) and the list of (t, y, event) that fired.
+# The last row is the state at the terminal event when one fired.
+def integrate_adaptive(f, t0: float, y0, t_end=np.inf, rtol=1e-8, atol=1e-10, events=(),
+                       h0=None, h_max=np.inf, max_steps=1000000):
+
+    t = float(t0)
+    y = np.array(y0, dtype=float)
+    fy = f(t, y)
+    ts = [t]
+    ys = [y]
+    fired = []
+    g_old = [event.func(t, y) for event in events]
+
+    if h0 is None:
+        scale = atol + rtol*np.abs(y)
+        d0 = np.sqrt(np.mean((y/scale)**2))
+        d1 = np.sqrt(np.mean((fy/scale)**2))
+        h0 = 1e-6 if d0 < 1e-5 or d1 < 1e-5 else 0.01*d0/d1
+    h = min(h0, h_max, t_end - t)
+
+    steps = 0
+    while t < t_end:
+        if steps >= max_steps:
+            raise RuntimeError('Adaptive integration did not finish within %d steps' % max_steps)
+        steps = steps + 1
+        h = min(h, h_max, t_end - t)
+
+        y_new, err, f_new = dp_step(f, t, y, fy, h)
+        scale = atol + rtol*np.maximum(np.abs(y), np.abs(y_new))
+        err_norm = np.sqrt(np.mean((err/scale)**2))
+        if err_norm > 1.:
+            h = h*max(0.2, 0.9*err_norm**-0.2)
+            continue
+
+        t_new = t + h
+        # every event crossing inside the accepted step
+        hits = []
+        g_new = [event.func(t_new, y_new) for event in events]
+        for i, event in enumerate(events):
+            a = g_old[i]
+            b = g_new[i]
+            crossed = (a < 0. <= b and event.direction >= 0) or (a > 0. >= b and event.direction <= 0)
+            if not crossed:
+                continue
+
+            def g_dense(tc, i=i):
+                return events[i].func(tc, hermite(tc, t, h, y, y_new, fy, f_new))
+
+            def g_step(tc, i=i):
+                return events[i].func(tc, y if tc <= t else dp_step(f, t, y, fy, tc - t)[0])
+
+            # bracket the crossing on the dense output first, then polish it on a shortened RK step
+            tc = find_root(g_dense, t, t_new, a, b, xtol=1e-6)
+            lo, hi = max(t, tc - 1e-3*h), min(t_new, tc + 1e-3*h)
+            g_lo, g_hi = g_step(lo), g_step(hi)
+            if (g_lo > 0.) == (g_hi > 0.):
+                lo, hi, g_lo, g_hi = t, t_new, a, b
+            tc = find_root(g_step, lo, hi, g_lo, g_hi)
+            hits.append((tc, i, event))
+
+        # in time order up to and including the earliest terminal event,
+        # each state is from a step redone up to the event time so it carries the integrator accuracy
+        terminal = None
+        for tc, i, event in sorted(hits, key=lambda hit: (hit[0], hit[1])):
+            y_ev = y if tc <= t else dp_step(f, t, y, fy, tc - t)[0]
+            fired.append((tc, y_ev, event))
+            if event.terminal:
+                terminal = (tc, y_ev)
+                break
+        if terminal is not None:
+            ts.append(terminal[0])
+            ys.append(terminal[1])
+            break
+
+        t = t_new
+        y = y_new
+        fy = f_new
+        g_old = g_new
+        ts.append(t)
+        ys.append(y)
+        h = h*min(5., 0.9*max(err_norm, 1e-10)**-0.2)
+
+    return np.array(ts), np.array(ys), fired
@@ -0,0 +1,148 @@
+# Inverse solver for the Ramp and Roll simulator
+# Finds the value of one free parameter (angle, height, width, slope length, mass, frictions or drag)
+# that makes the car stop at a target distance, for many targets at once.
+import numpy as np
+import RampRoll as RampRoll
+
+# search domain of every free parameter, height and width are bounded by the slope length at run time
+INVERSE_BOUNDS = {'theta': (0., 90.), 'height': (0., 1.), 'width': (0., 1.), 'slope_length': (1e-6, 1e4),
+                  'm': (1e-6, 1e4), 'u_r': (0., 10.), 'u_f': (0., 10.), 'c': (0., 1e3)}
+
+
+class InverseSolver:
+
+    def __init__(self, rr_obj, evaluator=None):
+
+        self.rr_obj = rr_obj
+        # evaluator(cases) fills cases['distance'] of a BATCH_DTYPE array, the closed form solver by default
+        self.evaluator = evaluator if evaluator is not None else rr_obj.solve_batch
+        # previous solutions per free parameter, (targets, solutions, ages) sorted by target, used as warm starts
+        self.history = {}
+        self.n_evaluations = 0
+
+    # final distance with the free parameter set to x, the other parameters from fixed
+    def distance(self, param: str, x, fixed: dict):
+
+        x = np.asarray(x, dtype=float)
+        values = dict(fixed)
+        length = np.asarray(values['slope_length'], dtype=float)
+        if param == 'height':
+            values['theta'] = np.arcsin(np.clip(x/length, 0., 1.))*180/np.pi
+        elif param == 'width':
+            values['theta'] = np.arccos(np.clip(x/length, 0., 1.))*180/np.pi
+        else:
+            values[param] = x
+        cases = RampRoll.batch_cases(*[values[name] for name in RampRoll.BATCH_INPUTS])
+        self.n_evaluations = self.n_evaluations + len(cases)
+        self.evaluator(cases)
+        return cases['distance'].reshape(x.shape)
+
+    # starting guess from the closest previous target, the middle of the domain without history
+    def warm_start(self, param: str, target, lo, hi):
+
+        if param in self.history and len(self.history[param][0]):
+            targets, solutions, ages = self.history[param]
+            # the nearest target is the one just above or just below in the sorted history
+            above = np.minimum(np.searchsorted(targets, target), len(targets) - 1)
+            below = np.maximum(above - 1, 0)
+            i = np.where(np.abs(target - targets[below]) <= np.abs(targets[above] - target), below, above)
+            guess = solutions[i]
+            return np.clip(np.where(np.isfinite(guess), guess, 0.5*(lo + hi)), lo, hi)
+        return 0.5*(lo + hi)
+
+    # add the solved targets to the history, only the newest max_history entries are kept
+    def remember(self, param: str, target, x, max_history=10000):
+
+        ok = np.isfinite(x) & np.isfinite(target)
+        targets, solutions, ages = self.history.get(param, (np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int64)))
+        first = ages.max() + 1 if len(ages) else 0
+        targets = np.concatenate((targets, target[ok]))
+        solutions = np.concatenate((solutions, x[ok]))
+        ages = np.concatenate((ages, first + np.arange(int(ok.sum()))))
+        if len(ages) > max_history:
+            keep = np.sort(np.argsort(ages)[-max_history:])
+            targets, solutions, ages = targets[keep], solutions[keep], ages[keep]
+        order = np.argsort(targets, kind='stable')
+        self.history[param] = (targets[order], solutions[order], ages[order])
+
+    # Value of param for which the final distance equals target (scalar or array).
+    # Parameters not given in fixed come from rr_obj, slope_length defaults to 5 as in RampRoll.run.
+    # Returns (x, converged); x is nan where no bracket was found (e.g. target beyond floor_limit).
+    def solve(self, target, param='theta', xtol=1e-10, max_iter=200, bounds=None, **fixed):
+
+        if param not in INVERSE_BOUNDS:
+            raise ValueError('Unknown free parameter %r' % param)
+        rr = self.rr_obj
+        values = {'m': rr.m, 'theta': rr.theta, 'u_r': rr.u_r, 'u_f': rr.u_f, 'c': rr.c, 'slope_length': 5.}
+        values.update(fixed)
+        target = np.asarray(target, dtype=float)
+        shape = np.broadcast_shapes(target.shape, *[np.shape(x) for x in values.values()])
+        target = np.broadcast_to(target, shape).astype(float)
+        values = {name: np.broadcast_to(np.asarray(x, dtype=float), shape) for name, x in values.items()}
+
+        lo_bound, hi_bound = bounds if bounds is not None else INVERSE_BOUNDS[param]
+        lo_bound = np.full(shape, lo_bound, dtype=float)
+        hi_bound = np.full(shape, hi_bound, dtype=float)
+        if param in ('height', 'width'):
+            hi_bound = hi_bound*values['slope_length']
+
+        # bracket: grow an interval around the warm start until the sign changes or it covers the domain
+        x0 = self.warm_start(param, target, lo_bound, hi_bound)
+        step = 1e-3*(hi_bound - lo_bound)
+        lo = x0.copy()
+        hi = x0.copy()
+        f0 = self.distance(param, x0, values) - target
+        f_lo = f0.copy()
+        f_hi = f0.copy()
+        bracketed = f0 == 0.
+        while True:
+            open_ = ~bracketed & ((lo > lo_bound) | (hi < hi_bound))
+            if not open_.any():
+                break
+            lo = np.where(open_, np.maximum(x0 - step, lo_bound), lo)
+            hi = np.where(open_, np.minimum(x0 + step, hi_bound), hi)
+            f_lo = np.where(open_, self.distance(param, lo, values) - target, f_lo)
+            f_hi = np.where(open_, self.distance(param, hi, values) - target, f_hi)
+            bracketed |= open_ & ((np.sign(f_lo) != np.sign(f_hi)) | (f_lo == 0.) | (f_hi == 0.))
+            # keep the half that already changes sign, the bracket is only ever widened where it does not
+            left = bracketed & open_ & (np.sign(f_lo) != np.sign(f0))
+            hi = np.where(left, x0, hi)
+            f_hi = np.where(left, f0, f_hi)
+            right = bracketed & open_ & ~left & (np.sign(f_hi) != np.sign(f0))
+            lo = np.where(right, x0, lo)
+            f_lo = np.where(right, f0, f_lo)
+            step = 4.*step
+
+        # Illinois iterations on all brackets at once
+        a = np.where(f_lo == 0., lo, np.where(f_hi == 0., hi, lo))
+        b = np.where(f_lo == 0., lo, np.where(f_hi == 0., hi, hi))
+        fa = np.where(bracketed, f_lo, np.nan)
+        fb = np.where(bracketed, f_hi, np.nan)
+        side = np.zeros(shape, dtype=int)
+        active = bracketed & (a != b)
+        for i in range(max_iter):
+            if not active.any():
+                break
+            with np.errstate(all='ignore'):
+                c = np.where(fb != fa, (a*fb - b*fa)/(fb - fa), 0.5*(a + b))
+            c = np.where((c > np.minimum(a, b)) & (c < np.maximum(a, b)), c, 0.5*(a + b))
+            fc = np.where(active, self.distance(param, c, values) - target, 0.)
+            same_b = (fc > 0.) == (fb > 0.)
+            move_b = active & same_b
+            move_a = active & ~same_b
+            b = np.where(move_b, c, b)
+            fb = np.where(move_b, fc, fb)
+            fa = np.where(move_b & (side == -1), 0.5*fa, fa)
+            a = np.where(move_a, c, a)
+            fa = np.where(move_a, fc, fa)
+            fb = np.where(move_a & (side == 1), 0.5*fb, fb)
+            side = np.where(move_b, -1, np.where(move_a, 1, side))
+            active &= (fc != 0.) & (np.abs(b - a) > xtol*np.maximum(1., np.abs(c)))
+
+        x = np.where(np.abs(fa) < np.abs(fb), a, b)
+        x = np.where(bracketed, x, np.nan)
+        converged = bracketed & ~active
+        self.remember(param, target.ravel(), x.ravel())
+        if x.ndim == 0:
+            return float(x), bool(converged)
+        return x, converged
@@ -0,0 +1,158 @@
+# Load generator for the local simulation service (SimServer.py)
+# Sends /predict requests with random cases from concurrent keep-alive connections and reports
+# throughput and latency percentiles:
+#   python LoadGen.py --concurrency 32 --requests 20000
+#   python LoadGen.py --spawn --workers 2      (starts its own server on a free port first)
+import sys
+import json
+import time
+import socket
+import threading
+import argparse
+import subprocess
+import http.client
+import numpy as np
+import SimServer as SimServer
+
+
+def make_parser():
+
+    parser = argparse.ArgumentParser(description='Load generator for the Ramp and Roll simulation service')
+    parser.add_argument('--host', default=SimServer.SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SimServer.SERVER_PORT)
+    parser.add_argument('--concurrency', type=int, default=32, help='parallel client connections')
+    parser.add_argument('--requests', type=int, default=10000, help='total number of requests')
+    parser.add_argument('--cases', type=int, default=1, help='cases per request')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--spawn', action='store_true', help='start a server on a free port for the run')
+    parser.add_argument('--workers', type=int, default=0, help='worker processes of the spawned server')
+    parser.add_argument('--output', default=None, help='write the report as JSON to this file')
+    return parser
+
+
+def random_records(rng, n: int):
+
+    return [{'m': float(m), 'theta': float(theta), 'u_r': float(u_r), 'u_f': float(u_f), 'c': float(c),
+             'slope_length': float(length)}
+            for m, theta, u_r, u_f, c, length in zip(rng.uniform(0.1, 5., n), rng.uniform(5., 60., n),
+                                                     rng.uniform(0., 0.2, n), rng.uniform(0.05, 0.3, n),
+                                                     rng.uniform(0., 0.01, n), rng.uniform(0.5, 5., n))]
+
+
+# one client connection, sends its share of the requests back to back
+def client(host: str, port: int, bodies, latencies: list, codes: dict, lock):
+
+    conn = http.client.HTTPConnection(host, port, timeout=SimServer.REQUEST_TIMEOUT_S)
+    local_latencies = []
+    local_codes = {}
+    for body in bodies:
+        t0 = time.perf_counter()
+        try:
+            conn.request('POST', '/predict', body, {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            response.read()
+            code = response.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=SimServer.REQUEST_TIMEOUT_S)
+            code = 'error'
+        local_latencies.append(time.perf_counter() - t0)
+        local_codes[code] = local_codes.get(code, 0) + 1
+    conn.close()
+    with lock:
+        latencies.extend(local_latencies)
+        for code, count in local_codes.items():
+            codes[code] = codes.get(code, 0) + count
+
+
+def run_load(host: str, port: int, concurrency=32, n_requests=10000, n_cases=1, seed=0) -> dict:
+
+    rng = np.random.default_rng(seed)
+    bodies = []
+    for i in range(n_requests):
+        records = random_records(rng, n_cases)
+        bodies.append(json.dumps(records if n_cases > 1 else records[0]).encode())
+
+    latencies = []
+    codes = {}
+    lock = threading.Lock()
+    threads = [threading.Thread(target=client, args=(host, port, bodies[i::concurrency], latencies, codes, lock))
+               for i in range(concurrency)]
+    t0 = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - t0
+
+    ms = 1e3*np.array(latencies)
+    ok = codes.get(200, 0)
+    report = {'requests': n_requests, 'concurrency': concurrency, 'cases_per_request': n_cases,
+              'seconds': elapsed, 'requests_per_s': ok/elapsed, 'cases_per_s': ok*n_cases/elapsed,
+              'status_codes': {str(code): count for code, count in codes.items()}}
+    for q in (50, 90, 99):
+        report['p%d_ms' % q] = float(np.percentile(ms, q))
+    report['max_ms'] = float(ms.max())
+    return report
+
+
+def get_json(host: str, port: int, path: str):
+
+    conn = http.client.HTTPConnection(host, port, timeout=5.)
+    try:
+        conn.request('GET', path)
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+
+# start MainControl.py --serve as a child process and wait until /health answers
+def spawn_server(host: str, workers: int):
+
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        port = sock.getsockname()[1]
+    proc = subprocess.Popen([sys.executable, 'MainControl.py', '--serve', '--host', host, '--port', str(port),
+                             '--workers', str(workers)], cwd=SimServer.__file__.rsplit('SimServer.py', 1)[0] or '.')
+    for i in range(100):
+        try:
+            get_json(host, port, '/health')
+            return proc, port
+        except OSError:
+            if proc.poll() is not None:
+                raise RuntimeError('Server did not start')
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError('Server did not answer /health')
+
+
+def main(argv=None) -> int:
+
+    args = make_parser().parse_args(argv)
+    proc = None
+    port = args.port
+    if args.spawn:
+        proc, port = spawn_server(args.host, args.workers)
+    try:
+        report = run_load(args.host, port, max(args.concurrency, 1), args.requests, max(args.cases, 1), args.seed)
+        report['server'] = get_json(args.host, port, '/stats')['batcher']
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    print('%d requests x %d cases, %d connections: %.0f req/s, %.0f cases/s' % (
+        report['requests'], report['cases_per_request'], report['concurrency'],
+        report['requests_per_s'], report['cases_per_s']))
+    print('latency p50 %.2f ms, p90 %.2f ms, p99 %.2f ms, max %.2f ms' % (
+        report['p50_ms'], report['p90_ms'], report['p99_ms'], report['max_ms']))
+    print('status codes %s, server mean batch %.1f cases' % (report['status_codes'],
+                                                            report['server']['mean_batch'] or 0.))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,8 +3,7 @@
 # Contact: kaoshihchuan@gmail.com
 
 # import os.path
-import tkinter as tk
-import TestPanel as TestPanel
+import sys
 import pathlib
 
 
@@ -13,7 +12,22 @@ def get_base_dir() -> str:
 # end get_base_dir
 
 
-def main():
+def main(argv=None):
+
+    if argv is None:
+        argv = sys.argv[1:]
+    # command line batch mode, no GUI start-up at all
+    if argv and argv[0] == '--batch':
+        import BatchCli as BatchCli
+        return BatchCli.run_batch_cli(argv[1:])
+    # local HTTP/JSON simulation service, headless as well
+    if argv and argv[0] == '--serve':
+        import SimServer as SimServer
+        return SimServer.run_server_cli(argv[1:])
+
+    # GUI modules (tkinter, matplotlib) are only loaded here, RampRoll itself is headless
+    import tkinter as tk
+    import TestPanel as TestPanel
 
     # Create UI to run
     rootgui = tk.Tk()
@@ -33,5 +47,5 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
 # end if
@@ -0,0 +1,143 @@
+# Monte Carlo uncertainty propagation for the Ramp and Roll simulator
+# Samples uncertain inputs (m, theta, u_r, u_f, c, slope_length) with a seeded RNG, evaluates them in
+# vectorized batches with RampRoll.solve_batch and stops once the confidence interval of the mean
+# final distance is tight enough.
+import statistics
+import numpy as np
+import RampRoll as RampRoll
+
+# rejection rounds of a truncated Normal before the rest is drawn by inverse CDF
+TRUNCATE_ROUNDS = 20
+
+
+class Normal:
+
+    def __init__(self, mean: float, std: float, lo=-np.inf, hi=np.inf):
+        self.mean = mean
+        self.std = std
+        self.lo = lo
+        self.hi = hi
+
+    # Truncated to [lo, hi], e.g. lo=0 for friction coefficients: values outside are drawn again, and the
+    # few left after TRUNCATE_ROUNDS (bounds far in a tail) come from the inverse CDF of the truncated range.
+    def sample(self, rng, n: int):
+
+        if not self.std > 0.:
+            return np.full(n, np.clip(self.mean, self.lo, self.hi), dtype=float)
+        x = rng.normal(self.mean, self.std, n)
+        out = (x < self.lo) | (x > self.hi)
+        for i in range(TRUNCATE_ROUNDS):
+            if not out.any():
+                return x
+            x[out] = rng.normal(self.mean, self.std, int(out.sum()))
+            out = (x < self.lo) | (x > self.hi)
+        dist = statistics.NormalDist(self.mean, self.std)
+        u = rng.uniform(dist.cdf(self.lo), dist.cdf(self.hi), int(out.sum()))
+        x[out] = [dist.inv_cdf(min(max(p, 1e-300), 1. - 1e-16)) for p in u]
+        # inv_cdf rounding can land a hair outside the bounds
+        return np.clip(x, self.lo, self.hi)
+
+
+class Uniform:
+
+    def __init__(self, lo: float, hi: float):
+        self.lo = lo
+        self.hi = hi
+
+    def sample(self, rng, n: int):
+        return rng.uniform(self.lo, self.hi, n)
+
+
+# user supplied samples (e.g. repeated measurements), drawn with replacement
+class Samples:
+
+    def __init__(self, values):
+        self.values = np.asarray(values, dtype=float)
+
+    def sample(self, rng, n: int):
+        return rng.choice(self.values, n)
+
+
+class MonteCarlo:
+
+    def __init__(self, rr_obj, distributions: dict, slope_length=5., seed=0, batch_size=100000,
+                 method='analytic'):
+
+        # parameters not in distributions (or given as plain numbers) stay fixed,
+        # the defaults come from rr_obj
+        self.rr_obj = rr_obj
+        self.fixed = {'m': rr_obj.m, 'theta': rr_obj.theta, 'u_r': rr_obj.u_r, 'u_f': rr_obj.u_f,
+                      'c': rr_obj.c, 'slope_length': slope_length}
+        self.distributions = {}
+        for name, dist in distributions.items():
+            if name not in RampRoll.BATCH_INPUTS:
+                raise ValueError('Unknown parameter %r' % name)
+            if hasattr(dist, 'sample'):
+                self.distributions[name] = dist
+            else:
+                self.fixed[name] = float(dist)
+        self.rng = np.random.default_rng(seed)
+        self.batch_size = batch_size
+        self.method = method
+
+    def sample_batch(self, n: int):
+
+        values = [self.distributions[name].sample(self.rng, n) if name in self.distributions
+                  else self.fixed[name] for name in RampRoll.BATCH_INPUTS]
+        return RampRoll.batch_cases(*values)
+
+    # Draw batches until the confidence interval half width of the mean distance is below
+    # max(abs_tol, rel_tol*|mean|) (after at least min_samples) or max_samples is reached.
+    # The statistics only use samples that ended on the floor (stopped / floor_limit), no_slide and error
+    # samples have no travel distance and are only counted in status_counts.
+    def run(self, max_samples=10**6, min_samples=10**4, rel_tol=1e-3, abs_tol=0., confidence=0.95,
+            percentiles=(1, 5, 25, 50, 75, 95, 99), bins=50):
+
+        if max_samples < 1:
+            raise ValueError('max_samples must be at least 1, got %r' % max_samples)
+        z = statistics.NormalDist().inv_cdf(0.5 + 0.5*confidence)
+        distances = []
+        statuses = []
+        n = 0
+        n_valid = 0
+        total = 0.
+        total_sq = 0.
+        mean = np.nan
+        half_width = np.inf
+        converged = False
+        # the first batch is just big enough for the first convergence check, then the batches double up to
+        # batch_size, so cheap inputs stop soon after min_samples
+        size = max(min_samples, 1)
+        while n < max_samples:
+            cases = self.sample_batch(min(size, self.batch_size, max_samples - n))
+            size = 2*size
+            self.rr_obj.solve_batch(cases, self.method)
+            valid = (cases['status'] == RampRoll.STATUS_STOPPED) | (cases['status'] == RampRoll.STATUS_FLOOR_LIMIT)
+            d = cases['distance'][valid]
+            distances.append(d)
+            statuses.append(cases['status'])
+            n = n + len(cases)
+            n_valid = n_valid + len(d)
+            if n_valid == 0:
+                continue
+            total = total + d.sum()
+            total_sq = total_sq + np.dot(d, d)
+            mean = total/n_valid
+            std = np.sqrt(max(total_sq/n_valid - mean*mean, 0.)*n_valid/max(n_valid - 1, 1))
+            half_width = z*std/np.sqrt(n_valid)
+            if n >= min_samples and n_valid > 1 and half_width <= max(abs_tol, rel_tol*abs(mean)):
+                converged = True
+                break
+
+        distances = np.concatenate(distances)
+        statuses = np.concatenate(statuses)
+        counts, edges = np.histogram(distances, bins=bins)
+        return {'n': n, 'n_valid': n_valid, 'converged': converged, 'mean': float(mean),
+                'std': float(distances.std(ddof=1)) if n_valid > 1 else 0.,
+                'ci_half_width': float(half_width), 'confidence': confidence,
+                'percentiles': dict(zip(percentiles, np.percentile(distances, percentiles).tolist()
+                                        if n_valid else [np.nan]*len(percentiles))),
+                'histogram': (counts, edges),
+                'status_counts': {RampRoll.STATUS_NAMES[s]: int(c)
+                                  for s, c in enumerate(np.bincount(statuses)) if c > 0},
+                'distances': distances}
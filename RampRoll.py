@@ -1,7 +1,11 @@
+# Ramp and Roll physics core, needs only numpy (no tkinter / matplotlib)
 import numpy as np
-import tkinter.messagebox as tkmsg
+import Integrator as Integrator
 
-# import matplotlib.pyplot as plt
+
+# raised when the car cannot slide down the ramp, the GUI shows it as a message box
+class NoSlideError(ValueError):
+    pass
 
 
 # a = 2*sqrt(ck)/ m , k = mg(sinA - u*cosA)
@@ -11,17 +15,14 @@ def v_ramp(t: float, c: float, m: float, theta: float, u: float, g=9.8):
 
     theta_rad = theta*np.pi/180.
     k = m*g*(np.sin(theta_rad) - (u*np.cos(theta_rad)))
-    v = 0
     if k <= 0.:
-        tkmsg.showinfo('Error',
-                       ' Car cannot slide down ! Ramp friction is too large or slope is not enough !'
-                       )
-        return v
+        raise NoSlideError(' Car cannot slide down ! Ramp friction is too large or slope is not enough !')
 
     a = 2*np.sqrt(c*k)/m
     b = c/k
     if c > 0.0:
-        v = (np.exp(a*t) - 1) / (np.exp(a*t)+1)
+        # (exp(a*t) - 1) / (exp(a*t) + 1) written as tanh so large a*t does not overflow
+        v = np.tanh(0.5*a*t)
         v = v/np.sqrt(b)
 
     else:
@@ -39,6 +40,319 @@ def v_slowdown(t: float, a: float, b: float):
     return v
 
 
+# status of a finished run
+# STATUS_STOPPED: the car came to rest on the floor
+# STATUS_FLOOR_LIMIT: the car passed floor_limit before stopping
+# STATUS_NO_SLIDE: ramp friction is too large or slope is not enough, the car never leaves the top
+STATUS_STOPPED = 0
+STATUS_FLOOR_LIMIT = 1
+STATUS_NO_SLIDE = 2
+# STATUS_MAX_STEPS: a time stepped batch case was cut off after max_steps steps
+STATUS_MAX_STEPS = 3
+# STATUS_ERROR: the case could not be evaluated (bad inputs or a failure in a sweep worker)
+STATUS_ERROR = 4
+# STATUS_ROLLED_BACK: on a piecewise track (Track.py) the car rolled back past the start of the track
+STATUS_ROLLED_BACK = 5
+# STATUS_EARLY_EXIT: run_summary was ended by stop_when while the car was still moving
+STATUS_EARLY_EXIT = 6
+STATUS_NAMES = {STATUS_STOPPED: 'stopped', STATUS_FLOOR_LIMIT: 'floor_limit', STATUS_NO_SLIDE: 'no_slide',
+                STATUS_MAX_STEPS: 'max_steps', STATUS_ERROR: 'error', STATUS_ROLLED_BACK: 'rolled_back',
+                STATUS_EARLY_EXIT: 'early_exit'}
+
+# one row per case of a batch run, inputs first then the results filled in by RampRoll.solve_batch
+BATCH_INPUTS = ('m', 'theta', 'u_r', 'u_f', 'c', 'slope_length')
+BATCH_DTYPE = np.dtype([('m', 'f8'), ('theta', 'f8'), ('u_r', 'f8'), ('u_f', 'f8'), ('c', 'f8'),
+                        ('slope_length', 'f8'),
+                        ('v_exit', 'f8'), ('t_exit', 'f8'), ('t_stop', 'f8'), ('distance', 'f8'),
+                        ('status', 'i1')])
+
+
+def _log_cosh(z):
+    z = np.abs(z)
+    return z + np.log1p(np.exp(-2.*z)) - np.log(2.)
+
+
+def _log_sinh(z):
+    return z + np.log1p(-np.exp(-2.*z)) - np.log(2.)
+
+
+# Closed forms for one phase of straight motion, dv/dt = k - gamma*v*v with v >= 0
+# k = g*(sin(angle) - u*cos(angle)) is the net slope acceleration, gamma = c/m
+# k > 0 : v approaches the terminal speed vt = sqrt(k/gamma) (tanh / coth shaped)
+# k < 0 : v = a1*tan(phi0 - b1*t) until the car stops
+# gamma = 0 : constant acceleration
+# every phase_* function takes scalars or numpy arrays and broadcasts over them
+def _phase_args(*args):
+    return np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in args])
+
+
+# speed v and travelled distance x at time t, both are held at the stop values after the car stops
+def phase_state(t, v0, k, gamma):
+
+    t, v0, k, gamma = _phase_args(t, v0, k, gamma)
+    v = np.empty_like(t)
+    x = np.empty_like(t)
+    with np.errstate(all='ignore'):
+        lin = gamma <= 0.
+        if lin.any():
+            t_stop = np.where(k < 0., v0/-k, np.inf)
+            tc = np.minimum(t, t_stop)
+            v[lin] = (v0 + k*tc)[lin]
+            x[lin] = (v0*tc + 0.5*k*tc*tc)[lin]
+
+        vt = np.sqrt(np.abs(k)/gamma)
+        r = np.sqrt(np.abs(k)*gamma)
+
+        # speeding up (or slowing down) towards the terminal speed
+        pos = ~lin & (k > 0.)
+        below = pos & (v0 < vt)
+        if below.any():
+            phi0 = np.arctanh(v0/vt)
+            z = phi0 + r*t
+            v[below] = (vt*np.tanh(z))[below]
+            x[below] = ((_log_cosh(z) - _log_cosh(phi0))/gamma)[below]
+        above = pos & (v0 > vt)
+        if above.any():
+            phi0 = np.arctanh(vt/v0)
+            z = phi0 + r*t
+            v[above] = (vt/np.tanh(z))[above]
+            x[above] = ((_log_sinh(z) - _log_sinh(phi0))/gamma)[above]
+        terminal = pos & (v0 == vt)
+        v[terminal] = vt[terminal]
+        x[terminal] = (vt*t)[terminal]
+
+        # drag only
+        zero = ~lin & (k == 0.)
+        v[zero] = (v0/(1. + gamma*v0*t))[zero]
+        x[zero] = (np.log1p(gamma*v0*t)/gamma)[zero]
+
+        # friction and drag both slow the car down
+        neg = ~lin & (k < 0.)
+        if neg.any():
+            phi0 = np.arctan(v0/vt)
+            phi = np.maximum(phi0 - r*t, 0.)
+            v[neg] = (vt*np.tan(phi))[neg]
+            x[neg] = (np.log(np.cos(phi)/np.cos(phi0))/gamma)[neg]
+
+    return v, x
+
+
+# time and distance until the car stops, np.inf when it never does
+def phase_stop(v0, k, gamma):
+
+    v0, k, gamma = _phase_args(v0, k, gamma)
+    with np.errstate(all='ignore'):
+        lin = gamma <= 0.
+        t_stop = np.where(lin, v0/-k, np.arctan(v0*np.sqrt(gamma/-k))/np.sqrt(-k*gamma))
+        x_stop = np.where(lin, 0.5*v0*v0/-k, 0.5*np.log1p(gamma*v0*v0/-k)/gamma)
+        moving = k >= 0.
+        t_stop = np.where(moving, np.inf, t_stop)
+        x_stop = np.where(moving, np.inf, x_stop)
+        at_rest = (v0 <= 0.) & (k <= 0.)
+        t_stop = np.where(at_rest, 0., t_stop)
+        x_stop = np.where(at_rest, 0., x_stop)
+
+    return t_stop, x_stop
+
+
+# speed after travelling a distance x, from d(v*v)/dx = 2*(k - gamma*v*v)
+# zero when the car stops before reaching x
+def phase_speed_at(x, v0, k, gamma):
+
+    x, v0, k, gamma = _phase_args(x, v0, k, gamma)
+    with np.errstate(all='ignore'):
+        e = np.exp(-2.*gamma*x)
+        v2 = np.where(gamma > 0., v0*v0*e - k*np.expm1(-2.*gamma*x)/gamma, v0*v0 + 2.*k*x)
+        v = np.sqrt(np.maximum(v2, 0.))
+        t_stop, x_stop = phase_stop(v0, k, gamma)
+        v = np.where(x >= x_stop, 0., v)
+
+    return v
+
+
+# time needed to travel a distance x, np.inf when the car stops before reaching x
+def phase_time_at(x, v0, k, gamma):
+
+    x, v0, k, gamma = _phase_args(x, v0, k, gamma)
+    t = np.empty_like(x)
+    with np.errstate(all='ignore'):
+        lin = gamma <= 0.
+        if lin.any():
+            v1 = phase_speed_at(x, v0, k, gamma)
+            t[lin] = (2.*x/(v0 + v1))[lin]
+
+        vt = np.sqrt(np.abs(k)/gamma)
+        r = np.sqrt(np.abs(k)*gamma)
+
+        # invert ln(cosh(z)) = gamma*x + ln(cosh(phi0)) , ln(sinh(z)) = gamma*x + ln(sinh(phi0))
+        pos = ~lin & (k > 0.)
+        below = pos & (v0 < vt)
+        if below.any():
+            phi0 = np.arctanh(v0/vt)
+            y = gamma*x + _log_cosh(phi0)
+            z = y + np.log1p(np.sqrt(-np.expm1(-2.*y)))
+            t[below] = ((z - phi0)/r)[below]
+        above = pos & (v0 > vt)
+        if above.any():
+            phi0 = np.arctanh(vt/v0)
+            y = gamma*x + _log_sinh(phi0)
+            z = y + np.log1p(np.sqrt(1. + np.exp(-2.*y)))
+            t[above] = ((z - phi0)/r)[above]
+        terminal = pos & (v0 == vt)
+        t[terminal] = (x/vt)[terminal]
+
+        zero = ~lin & (k == 0.)
+        t[zero] = (np.expm1(gamma*x)/(gamma*v0))[zero]
+
+        # cos(phi) = cos(phi0)*exp(gamma*x)
+        neg = ~lin & (k < 0.)
+        if neg.any():
+            phi0 = np.arctan(v0/vt)
+            phi = np.arccos(np.minimum(np.cos(phi0)*np.exp(gamma*x), 1.))
+            t[neg] = ((phi0 - phi)/r)[neg]
+
+        t_stop, x_stop = phase_stop(v0, k, gamma)
+        t = np.where(x > x_stop, np.inf, t)
+        t = np.where(x <= 0., 0., t)
+
+    return t
+
+
+# h(b) = (1 - exp(-b))/b and dh/db, a series for small b where the closed forms cancel
+def _decay_ratio(b):
+
+    small = np.abs(b) < 1e-3
+    bs = np.where(small, 1., b)
+    h = np.where(small, 1. - b/2. + b*b/6., -np.expm1(-bs)/bs)
+    dh = np.where(small, -0.5 + b/3. - b*b/8., (np.exp(-bs)*(1. + bs) - 1.)/(bs*bs))
+    return h, dh
+
+
+# f(a) = ln(1 + a)/a and df/da, same idea as _decay_ratio
+def _log_ratio(a):
+
+    small = np.abs(a) < 1e-3
+    a_s = np.where(small, 1., a)
+    f = np.where(small, 1. - a/2. + a*a/3., np.log1p(a_s)/a_s)
+    df = np.where(small, -0.5 + 2.*a/3. - 0.75*a*a, (a_s/(1. + a_s) - np.log1p(a_s))/(a_s*a_s))
+    return f, df
+
+
+# floor phase closed form of m*dv/dt = -(u*m*g + c*v*v), starting from v0 at t = 0
+# v = a1*tan(phi0 - b1*t) , phi0 = arctan(v0/a1)
+# x = (m/c)*ln(cos(phi0 - b1*t)/cos(phi0))
+# a1 = sqrt(u*m*g/c) , b1 = sqrt(u*c*g/m) , the car stops at t = phi0/b1
+# t can be a numpy array, v and x stay at the stop values after the car stops
+def floor_state(t, v0: float, c: float, m: float, u: float, g=9.8):
+
+    return phase_state(t, v0, -1.*u*g, c/m)
+
+
+# Build the batch state for a set of cases.
+# Each parameter is a scalar or a 1-d array. With grid=False the arrays are broadcast against each other,
+# with grid=True every combination of the values is a case (Cartesian grid, m varies slowest).
+def batch_cases(m, theta, u_r, u_f, c, slope_length, grid=False):
+
+    values = [np.atleast_1d(np.asarray(x, dtype=float)) for x in (m, theta, u_r, u_f, c, slope_length)]
+    if grid:
+        values = [x.ravel() for x in np.meshgrid(*values, indexing='ij')]
+    else:
+        values = [x.ravel() for x in np.broadcast_arrays(*values)]
+
+    cases = np.zeros(values[0].size, dtype=BATCH_DTYPE)
+    for name, x in zip(BATCH_INPUTS, values):
+        cases[name] = x
+    return cases
+
+
+# Trajectory and summary of one run.
+# The samples live in one contiguous structured array with the named columns v, s, t (float64, or float32
+# to halve the size); va / sa / ta are zero-copy column views and the object still unpacks like the old
+# (va, sa, ta) tuple: va, sa, ta = rr.run(5)
+class RunResult:
+    __slots__ = ('data', 'n', 'status', 't_exit', 'v_exit', 't_stop', 'v_end', 'distance')
+
+    def __init__(self, capacity: int, dtype=np.float64):
+
+        self.data = np.empty(max(int(capacity), 1), dtype=[('v', dtype), ('s', dtype), ('t', dtype)])
+        self.n = 0
+        self.status = STATUS_STOPPED
+        self.t_exit = 0.
+        self.v_exit = 0.
+        self.t_stop = 0.
+        self.v_end = 0.
+        self.distance = 0.
+
+    @classmethod
+    def from_arrays(cls, va, sa, ta, dtype=np.float64):
+
+        result = cls(len(va), dtype)
+        result.data['v'][:len(va)] = va
+        result.data['s'][:len(va)] = sa
+        result.data['t'][:len(va)] = ta
+        result.finish(len(va))
+        return result
+
+    # double the capacity, returns the new data array
+    def grow(self):
+
+        data = np.empty(2*len(self.data), dtype=self.data.dtype)
+        data[:len(self.data)] = self.data
+        self.data = data
+        return data
+
+    # Set the sample count and the summary fields from the samples.
+    # The ramp exit is the first sample with s >= 0, the run hit the floor limit if the car still moves.
+    def finish(self, n: int):
+
+        self.n = n
+        if len(self.data) > n + n//4 + 16:
+            self.data = self.data[:n].copy()
+        if n == 0:
+            return
+        va, sa, ta = self.va, self.sa, self.ta
+        exited = sa >= 0.
+        j = int(np.argmax(exited)) if exited.any() else n - 1
+        self.t_exit = float(ta[j])
+        self.v_exit = float(va[j])
+        self.t_stop = float(ta[-1])
+        self.v_end = float(va[-1])
+        self.distance = float(sa[-1])
+        self.status = STATUS_FLOOR_LIMIT if self.v_end > 0. else STATUS_STOPPED
+
+    @property
+    def va(self):
+        return self.data['v'][:self.n]
+
+    @property
+    def sa(self):
+        return self.data['s'][:self.n]
+
+    @property
+    def ta(self):
+        return self.data['t'][:self.n]
+
+    def __iter__(self):
+        return iter((self.va, self.sa, self.ta))
+
+    def __getitem__(self, i):
+        return (self.va, self.sa, self.ta)[i]
+
+    def summary(self) -> dict:
+        return {'status': self.status, 't_exit': self.t_exit, 'v_exit': self.v_exit, 't_stop': self.t_stop,
+                'v_end': self.v_end, 'distance': self.distance, 'n_steps': self.n}
+
+    # zero-copy views of the samples, as a structured array and as a raw buffer
+    def to_numpy(self):
+        return self.data[:self.n]
+
+    def to_memoryview(self):
+        return memoryview(self.data[:self.n])
+
+    def save_npz(self, path):
+        np.savez(path, v=self.va, s=self.sa, t=self.ta, **self.summary())
+
+
 class RampRoll:
 
     def __init__(self):
@@ -55,6 +369,17 @@ class RampRoll:
         # simulation delta t (s)
         self.dt = 0.001
         self.floor_limit = 100
+        # number of floor steps evaluated per array op in run_vectorized
+        self.chunk_size = 65536
+        # sample type of RunResult, np.float32 halves the memory of long trajectories
+        self.result_dtype = np.float64
+        # run_vectorized refuses runs longer than this many steps (e.g. drag only, the car never stops)
+        self.max_steps = 10**8
+        # error tolerances of run_adaptive
+        self.rtol = 1e-8
+        self.atol = 1e-10
+        # optional Profiler.RunProfiler, collects per phase timings of the engines when set
+        self.profiler = None
 
     def set_car_mass(self, m_: float):
         self.m = m_
@@ -96,32 +421,52 @@ class RampRoll:
         v = np.sqrt(2*k/self.m)
         return v
 
+    # initial RunResult capacity for run(), from the closed form stop time
+    def estimate_steps(self, slope_length=5) -> int:
+
+        t_stop = self.solve(slope_length)['t_stop']
+        if not np.isfinite(t_stop):
+            return 2**20
+        return int(min(1.01*t_stop/self.dt + 16, 2**20))
+
     def run(self, slope_length=5):
 
+        prof = self.profiler
+        if prof is not None:
+            t_prof = prof.start()
         t = 0.
         dt = self.dt
         s = -1*slope_length
-        va = []
-        ta = []
-        sa = []
+        result = RunResult(self.estimate_steps(slope_length), self.result_dtype)
+        data = result.data
+        i = 0
+        vi = 0.
+        n_grow = 0
+        if prof is not None:
+            prof.stop('estimate', t_prof, allocs=1)
+            t_prof = prof.start()
         while s < 0.0:
             vi = v_ramp(t, self.c, self.m, self.theta, self.u_r, self.g)
             if vi == 0. and t > 0.:
                 break
             # print(' vi = %.3f , %.3f ' % (vi, vj))
             s = s + (vi*dt)
-            va.append(vi)
-            ta.append(t)
-            sa.append(s)
+            if i == len(data):
+                data = result.grow()
+                n_grow = n_grow + 1
+            data[i] = (vi, s, t)
+            i = i + 1
             t = t + dt
-        # print(' number of accelerating = %d , s = %.3f' % (len(va), sa[-2]))
-        if len(va) < 1:
-            return va, sa, ta
-
-        v = va[-1]
+        # print(' number of accelerating = %d , s = %.3f' % (i, s))
+        n_ramp = i
+        if prof is not None:
+            prof.stop('ramp', t_prof, steps=n_ramp, allocs=n_grow)
+            t_prof = prof.start()
+            n_grow = 0
+
+        v = vi
         # a1 = np.sqrt(self.u*self.m*self.g/self.c)
         # b1 = np.sqrt(self.u*self.c*self.g/self.m)
-        i = 0
         while v > 0:
 
             t = t + dt
@@ -130,17 +475,18 @@ class RampRoll:
             w_drag = self.air_drag_loss(v, v*dt)
             v = self.get_velocity_from_kinematics(k - w_friction - w_drag)
             # print('[%d] v = %.4f' % (i, v))
-            dv = v - va[-1]
-            a = dv/dt
-            # print(' a = %.5f ' % a)
             s = s + (v*dt)
 
-            va.append(v)
-            ta.append(t)
-            sa.append(s)
+            if i == len(data):
+                data = result.grow()
+                n_grow = n_grow + 1
+            data[i] = (v, s, t)
             i = i + 1
             if s > self.floor_limit:
                 break
+        if prof is not None:
+            prof.stop('floor', t_prof, steps=i - n_ramp, allocs=n_grow)
+            t_prof = prof.start()
 
         # print(' number of decelerating = %d , s = %.3f' % (len(va), sa[-2]))
         '''
@@ -158,7 +504,506 @@ class RampRoll:
 
         plt.show()
         '''
-        return va, sa, ta
+        result.finish(i)
+        if prof is not None:
+            prof.stop('finish', t_prof)
+        return result
+
+    # Same RunResult as run(), built with array ops instead of a per-dt loop.
+    # The ramp phase is the same rectangle sum over v_ramp on a precomputed time grid.
+    # The floor phase samples the closed form floor_state on the dt grid, chunk_size steps at a time,
+    # instead of subtracting friction and drag energy step by step, so it agrees with run() to O(dt).
+    def run_vectorized(self, slope_length=5):
+
+        chunks = list(self.iter_run(slope_length))
+        prof = self.profiler
+        if prof is not None:
+            t_prof = prof.start()
+        n = sum(len(chunk[0]) for chunk in chunks)
+        result = RunResult(n, self.result_dtype)
+        i = 0
+        for va, sa, ta in chunks:
+            result.data['v'][i:i + len(va)] = va
+            result.data['s'][i:i + len(va)] = sa
+            result.data['t'][i:i + len(va)] = ta
+            i = i + len(va)
+        result.finish(n)
+        if prof is not None:
+            prof.stop('assemble', t_prof, allocs=1)
+        return result
+
+    # Generator form of run_vectorized, yields (va, sa, ta) chunks of at most chunk_size samples
+    # as they are computed, so memory stays flat however small dt is.
+    # decimate: keep only every n-th sample (the final sample is always kept).
+    # stop_when(va, sa, ta): boolean array per chunk, the run ends at (and includes) the first True sample,
+    #   e.g. lambda va, sa, ta: sa > 10. or lambda va, sa, ta: (ta > 1.) & (va < 0.5)
+    def iter_run(self, slope_length=5, decimate=1, stop_when=None):
+
+        if decimate < 1:
+            raise ValueError('decimate must be at least 1, got %r' % decimate)
+        i = 0
+        last = None
+        for va, sa, ta in self._iter_chunks(slope_length):
+            done = False
+            if stop_when is not None:
+                hit = np.asarray(stop_when(va, sa, ta), dtype=bool)
+                if hit.any():
+                    n = int(np.argmax(hit)) + 1
+                    va, sa, ta = va[:n], sa[:n], ta[:n]
+                    done = True
+            last = (va[-1:], sa[-1:], ta[-1:])
+            first = (-i) % decimate
+            n = len(va)
+            i = i + n
+            if decimate > 1:
+                va, sa, ta = va[first::decimate], sa[first::decimate], ta[first::decimate]
+                # whether the final sample of this chunk was kept
+                if (n - 1 - first) % decimate == 0:
+                    last = None
+            else:
+                last = None
+            if len(va) > 0:
+                yield va, sa, ta
+            if done:
+                break
+        if last is not None:
+            yield last
+
+    def _iter_chunks(self, slope_length):
+
+        dt = self.dt
+        theta_rad = self.theta*np.pi/180.
+        k = self.m*self.g*(np.sin(theta_rad) - (self.u_r*np.cos(theta_rad)))
+        if k <= 0.:
+            raise NoSlideError(' Car cannot slide down ! Ramp friction is too large or slope is not enough !')
+
+        # ramp: same order of additions as run(), starting from s = -slope_length
+        # the closed form exit time sizes the first chunk, the rectangle sum needs at most one more step
+        gamma = self.c/self.m
+        t_exit = phase_time_at(slope_length, 0., k/self.m, gamma)
+        chunk_size = int(min(self.chunk_size, t_exit/dt + 3))
+        # the profiler times each chunk up to its yield, one sample buffer allocation per chunk
+        prof = self.profiler
+        s0 = -1.*slope_length
+        i = 0
+        while True:
+            if prof is not None:
+                t_prof = prof.start()
+            ta = np.arange(i, i + chunk_size)*dt
+            va = v_ramp(ta, self.c, self.m, self.theta, self.u_r, self.g)
+            sa = np.cumsum(np.concatenate(([s0], va*dt)))[1:]
+            exited = sa >= 0.
+            if exited.any():
+                n_ramp = int(np.argmax(exited)) + 1
+                if prof is not None:
+                    prof.stop('ramp', t_prof, steps=n_ramp, allocs=1)
+                yield va[:n_ramp], sa[:n_ramp], ta[:n_ramp]
+                break
+            if prof is not None:
+                prof.stop('ramp', t_prof, steps=chunk_size, allocs=1)
+            yield va, sa, ta
+            s0 = sa[-1]
+            i = i + chunk_size
+            chunk_size = self.chunk_size
+            if i > self.max_steps:
+                raise ValueError('Run needs more than %d steps on the ramp !' % self.max_steps)
+
+        v0 = va[n_ramp - 1]
+        s0 = sa[n_ramp - 1]
+        t0 = ta[n_ramp - 1]
+        k_floor = -1.*self.u_f*self.g
+        t_floor, x_floor = phase_stop(v0, k_floor, gamma)
+        if x_floor > self.floor_limit - s0:
+            t_floor = phase_time_at(self.floor_limit - s0, v0, k_floor, gamma)
+        if i + n_ramp + t_floor/dt > self.max_steps:
+            raise ValueError('Run needs more than %d steps, the car hardly slows down on the floor !'
+                             % self.max_steps)
+
+        chunk_size = int(min(self.chunk_size, t_floor/dt + 2))
+        i = 0
+        while v0 > 0:
+            if prof is not None:
+                t_prof = prof.start()
+            steps = np.arange(i + 1, i + chunk_size + 1)
+            v, x = floor_state(steps*dt, v0, self.c, self.m, self.u_f, self.g)
+            s = s0 + x
+            done = (v <= 0.) | (s > self.floor_limit)
+            if done.any():
+                n_floor = int(np.argmax(done)) + 1
+                ta = t0 + steps[:n_floor]*dt
+                if prof is not None:
+                    prof.stop('floor', t_prof, steps=n_floor, allocs=1)
+                yield v[:n_floor], s[:n_floor], ta
+                break
+            ta = t0 + steps*dt
+            if prof is not None:
+                prof.stop('floor', t_prof, steps=chunk_size, allocs=1)
+            yield v, s, ta
+            i = i + chunk_size
+            chunk_size = self.chunk_size
+
+    # Summary of a run without keeping the trajectory: ramp exit, end time / speed / distance, step count.
+    # engine='vectorized' streams iter_run chunks (memory bounded by chunk_size),
+    # engine='step' is the scalar per-dt loop of run() that stores nothing per step.
+    # stop_when is an elementwise predicate on (v, s, t) as in iter_run, early_exit tells whether it fired
+    # (the status is then STATUS_EARLY_EXIT unless the car had already stopped or passed floor_limit).
+    def run_summary(self, slope_length=5, stop_when=None, engine='vectorized'):
+
+        if engine == 'step':
+            return self._run_summary_step(slope_length, stop_when)
+        if engine != 'vectorized':
+            raise ValueError('Unknown engine %r' % engine)
+
+        result = {'status': STATUS_STOPPED, 't_exit': 0., 'v_exit': 0., 't_stop': 0., 'v_end': 0.,
+                  'distance': -1.*slope_length, 'n_steps': 0, 'early_exit': False}
+        on_ramp = True
+        hit = False
+        for va, sa, ta in self.iter_run(slope_length):
+            n = len(va)
+            if stop_when is not None:
+                stop = np.asarray(stop_when(va, sa, ta), dtype=bool)
+                if stop.any():
+                    n = int(np.argmax(stop)) + 1
+                    hit = True
+            if on_ramp:
+                exited = sa[:n] >= 0.
+                if exited.any():
+                    j = int(np.argmax(exited))
+                    result['t_exit'] = float(ta[j])
+                    result['v_exit'] = float(va[j])
+                    on_ramp = False
+            result['n_steps'] = result['n_steps'] + n
+            result['t_stop'] = float(ta[n - 1])
+            result['v_end'] = float(va[n - 1])
+            result['distance'] = float(sa[n - 1])
+            if hit:
+                break
+        return self._finish_summary(result, hit)
+
+    def _run_summary_step(self, slope_length, stop_when):
+
+        dt = self.dt
+        t = 0.
+        s = -1*slope_length
+        vi = 0.
+        n = 0
+        result = {'status': STATUS_STOPPED, 't_exit': 0., 'v_exit': 0., 't_stop': 0., 'v_end': 0.,
+                  'distance': s, 'n_steps': 0, 'early_exit': False}
+        prof = self.profiler
+        if prof is not None:
+            t_prof = prof.start()
+        while s < 0.0:
+            vi = v_ramp(t, self.c, self.m, self.theta, self.u_r, self.g)
+            s = s + (vi*dt)
+            n = n + 1
+            if stop_when is not None and stop_when(vi, s, t):
+                result.update(t_stop=t, v_end=float(vi), distance=float(s), n_steps=n)
+                if prof is not None:
+                    prof.stop('ramp', t_prof, steps=n)
+                return self._finish_summary(result, True)
+            t = t + dt
+        result['t_exit'] = t - dt
+        result['v_exit'] = float(vi)
+        n_ramp = n
+        if prof is not None:
+            prof.stop('ramp', t_prof, steps=n_ramp)
+            t_prof = prof.start()
+
+        v = vi
+        hit = False
+        while v > 0:
+            t = t + dt
+            k = self.kinematic_energy(v)
+            w_friction = self.friction_loss(v*dt, self.u_f)
+            w_drag = self.air_drag_loss(v, v*dt)
+            v = self.get_velocity_from_kinematics(k - w_friction - w_drag)
+            s = s + (v*dt)
+            n = n + 1
+            if stop_when is not None and stop_when(v, s, t):
+                hit = True
+                break
+            if s > self.floor_limit:
+                break
+        if prof is not None:
+            prof.stop('floor', t_prof, steps=n - n_ramp)
+        result.update(t_stop=t, v_end=float(v), distance=float(s), n_steps=n)
+        return self._finish_summary(result, hit)
+
+    def _finish_summary(self, result: dict, early_exit: bool):
+
+        result['early_exit'] = early_exit
+        if result['distance'] > self.floor_limit:
+            result['status'] = STATUS_FLOOR_LIMIT
+        elif early_exit and result['v_end'] > 0.:
+            result['status'] = STATUS_EARLY_EXIT
+        return result
+
+    # Analytic solver, no time stepping at all.
+    # The ramp exit time and speed, the stop time (or floor_limit crossing time) and the final distance
+    # come from the closed form phase_* solutions, so the cost does not depend on dt.
+    # The trajectory is only sampled at the requested output times t_out (va, sa, ta in the result).
+    def solve(self, slope_length=5, t_out=None):
+
+        prof = self.profiler
+        if prof is not None:
+            t_prof = prof.start()
+        theta_rad = self.theta*np.pi/180.
+        k_ramp = self.g*(np.sin(theta_rad) - (self.u_r*np.cos(theta_rad)))
+        k_floor = -1.*self.u_f*self.g
+        gamma = self.c/self.m
+
+        result = {'status': STATUS_NO_SLIDE, 't_exit': 0., 'v_exit': 0.,
+                  't_stop': 0., 'v_end': 0., 'distance': -1.*slope_length}
+        if k_ramp > 0.:
+            t_exit = float(phase_time_at(slope_length, 0., k_ramp, gamma))
+            v_exit = float(phase_speed_at(slope_length, 0., k_ramp, gamma))
+            t_floor, x_floor = phase_stop(v_exit, k_floor, gamma)
+            result['t_exit'] = t_exit
+            result['v_exit'] = v_exit
+            if x_floor > self.floor_limit:
+                result['status'] = STATUS_FLOOR_LIMIT
+                result['t_stop'] = t_exit + float(phase_time_at(self.floor_limit, v_exit, k_floor, gamma))
+                result['v_end'] = float(phase_speed_at(self.floor_limit, v_exit, k_floor, gamma))
+                result['distance'] = float(self.floor_limit)
+            else:
+                result['status'] = STATUS_STOPPED
+                result['t_stop'] = t_exit + float(t_floor)
+                result['distance'] = float(x_floor)
+
+        if t_out is not None:
+            ta = np.asarray(t_out, dtype=float)
+            tc = np.clip(ta, 0., result['t_stop'])
+            on_ramp = tc <= result['t_exit']
+            v_r, x_r = phase_state(np.minimum(tc, result['t_exit']), 0., max(k_ramp, 0.), gamma)
+            v_f, x_f = phase_state(tc - result['t_exit'], result['v_exit'], k_floor, gamma)
+            result['va'] = np.where(on_ramp, v_r, v_f)
+            result['sa'] = np.where(on_ramp, x_r - slope_length, np.minimum(x_f, result['distance']))
+            result['ta'] = ta
+
+        if prof is not None:
+            prof.stop('solve', t_prof)
+        return result
+
+    # Same RunResult as run() but integrated with the adaptive Dormand-Prince scheme of Integrator.py,
+    # so the accuracy is set by rtol / atol instead of dt and the samples are the accepted steps.
+    # The ramp exit, the stop (v = 0) and the floor_limit crossing are located as exact events.
+    def run_adaptive(self, slope_length=5):
+
+        theta_rad = self.theta*np.pi/180.
+        k_ramp = self.g*(np.sin(theta_rad) - (self.u_r*np.cos(theta_rad)))
+        if k_ramp <= 0.:
+            raise NoSlideError(' Car cannot slide down ! Ramp friction is too large or slope is not enough !')
+        k_floor = -1.*self.u_f*self.g
+        gamma = self.c/self.m
+        # no ramp: the car starts at rest at the bottom, as in run_vectorized (the exit event needs s < 0)
+        if slope_length <= 0.:
+            return RunResult.from_arrays([0.], [0.], [0.], self.result_dtype)
+
+        # state y = (s, v)
+        def ramp_rhs(t, y):
+            return np.array([y[1], k_ramp - gamma*y[1]*y[1]])
+
+        def floor_rhs(t, y):
+            return np.array([y[1], k_floor - gamma*y[1]*y[1]])
+
+        prof = self.profiler
+        if prof is not None:
+            t_prof = prof.start()
+        exit_event = Integrator.Event(lambda t, y: y[0], direction=1, name='exit')
+        ta_r, ya_r, fired = Integrator.integrate_adaptive(ramp_rhs, 0., [-1.*slope_length, 0.],
+                                                          rtol=self.rtol, atol=self.atol, events=[exit_event])
+        t_exit = ta_r[-1]
+        v_exit = ya_r[-1][1]
+        if prof is not None:
+            prof.stop('ramp', t_prof, steps=len(ta_r) - 1)
+            t_prof = prof.start()
+
+        stop_event = Integrator.Event(lambda t, y: y[1], direction=-1, name='stop')
+        limit_event = Integrator.Event(lambda t, y: y[0] - self.floor_limit, direction=1, name='floor_limit')
+        ta_f, ya_f, fired = Integrator.integrate_adaptive(floor_rhs, t_exit, [0., v_exit],
+                                                          rtol=self.rtol, atol=self.atol,
+                                                          events=[stop_event, limit_event])
+        if fired and fired[-1][2] is stop_event:
+            ya_f[-1][1] = 0.
+        if fired and fired[-1][2] is limit_event:
+            ya_f[-1][0] = self.floor_limit
+        if prof is not None:
+            prof.stop('floor', t_prof, steps=len(ta_f) - 1)
+
+        ta = np.concatenate((ta_r, ta_f[1:]))
+        ya = np.concatenate((ya_r[:-1], [[0., v_exit]], ya_f[1:]))
+        return RunResult.from_arrays(ya[:, 1], ya[:, 0], ta, self.result_dtype)
+
+    # Batch entry point for parameter sweeps, one case per row of the returned BATCH_DTYPE array.
+    # Parameters left as None take the current value of this RampRoll; see batch_cases for grid.
+    def run_batch(self, m=None, theta=None, u_r=None, u_f=None, c=None, slope_length=5,
+                  grid=False, method='analytic'):
+
+        cases = batch_cases(self.m if m is None else m,
+                            self.theta if theta is None else theta,
+                            self.u_r if u_r is None else u_r,
+                            self.u_f if u_f is None else u_f,
+                            self.c if c is None else c,
+                            slope_length, grid)
+        return self.solve_batch(cases, method)
+
+    # Fill in the results of a BATCH_DTYPE array in place (g, dt, floor_limit come from this RampRoll).
+    # method='analytic' evaluates solve() for all cases at once.
+    # method='step' integrates all cases together with the same per-dt scheme as run(),
+    # dropping finished cases from the working set as they stop.
+    def solve_batch(self, cases, method='analytic'):
+
+        prof = self.profiler
+        if prof is not None:
+            t_prof = prof.start()
+        if method == 'analytic':
+            self._solve_batch_analytic(cases)
+        elif method == 'step':
+            self._solve_batch_step(cases)
+        else:
+            raise ValueError('Unknown batch method %r' % method)
+        if prof is not None:
+            prof.stop('batch', t_prof, steps=len(cases))
+        return cases
+
+    # d(distance)/d(input) for every case of a BATCH_DTYPE array, one array per name of BATCH_INPUTS
+    # (theta per degree). The derivatives are taken of the closed form solution of solve_batch('analytic'),
+    # whose results are filled into cases as well:
+    #   v_exit^2 = q = 2*k*L*h(2*gamma*L) , distance = q/(2*K)*f(gamma*q/K) , K = u_f*g , gamma = c/m
+    # Cases past floor_limit have zero sensitivities (the distance is clamped there),
+    # cases that do not slide have d/d(slope_length) = -1 and zero for the rest.
+    def sensitivity_batch(self, cases):
+
+        self._solve_batch_analytic(cases)
+        g = self.g
+        theta_rad = cases['theta']*np.pi/180.
+        k_ramp = g*(np.sin(theta_rad) - (cases['u_r']*np.cos(theta_rad)))
+        k_floor = cases['u_f']*g
+        gamma = cases['c']/cases['m']
+        length = cases['slope_length']
+        stopped = cases['status'] == STATUS_STOPPED
+
+        with np.errstate(all='ignore'):
+            # ramp exit speed squared and its partial derivatives
+            h, dh = _decay_ratio(2.*gamma*length)
+            q = 2.*k_ramp*length*h
+            q_k = 2.*length*h
+            q_length = 2.*k_ramp*np.exp(-2.*gamma*length)
+            q_gamma = 4.*k_ramp*length*length*dh
+            # floor stopping distance
+            f, df = _log_ratio(gamma*q/k_floor)
+            x_q = 0.5/(k_floor + gamma*q)
+            x_k = -1.*q*x_q/k_floor
+            x_gamma = 0.5*q*q*df/(k_floor*k_floor)
+            d_gamma = x_q*q_gamma + x_gamma
+
+            sens = {'m': -1.*d_gamma*cases['c']/(cases['m']*cases['m']),
+                    'theta': x_q*q_k*g*(np.cos(theta_rad) + cases['u_r']*np.sin(theta_rad))*np.pi/180.,
+                    'u_r': -1.*x_q*q_k*g*np.cos(theta_rad),
+                    'u_f': x_k*g,
+                    'c': d_gamma/cases['m'],
+                    'slope_length': x_q*q_length}
+        for name in BATCH_INPUTS:
+            sens[name] = np.where(stopped, sens[name], 0.)
+        sens['slope_length'] = np.where(cases['status'] == STATUS_NO_SLIDE, -1., sens['slope_length'])
+        return sens
+
+    # sensitivity_batch for the current parameters, one float per input
+    def sensitivities(self, slope_length=5) -> dict:
+
+        cases = batch_cases(self.m, self.theta, self.u_r, self.u_f, self.c, slope_length)
+        return {name: float(x[0]) for name, x in self.sensitivity_batch(cases).items()}
+
+    def _solve_batch_analytic(self, cases):
+
+        theta_rad = cases['theta']*np.pi/180.
+        k_ramp = self.g*(np.sin(theta_rad) - (cases['u_r']*np.cos(theta_rad)))
+        k_floor = -1.*cases['u_f']*self.g
+        gamma = cases['c']/cases['m']
+        length = cases['slope_length']
+        slide = k_ramp > 0.
+
+        t_exit = np.where(slide, phase_time_at(length, 0., k_ramp, gamma), 0.)
+        v_exit = np.where(slide, phase_speed_at(length, 0., k_ramp, gamma), 0.)
+        t_floor, x_floor = phase_stop(v_exit, k_floor, gamma)
+        limit = slide & (x_floor > self.floor_limit)
+        t_limit = np.where(limit, phase_time_at(self.floor_limit, v_exit, k_floor, gamma), 0.)
+
+        cases['t_exit'] = t_exit
+        cases['v_exit'] = v_exit
+        cases['t_stop'] = np.where(limit, t_exit + t_limit, np.where(slide, t_exit + t_floor, 0.))
+        cases['distance'] = np.where(limit, self.floor_limit, np.where(slide, x_floor, -1.*length))
+        cases['status'] = np.where(limit, STATUS_FLOOR_LIMIT, np.where(slide, STATUS_STOPPED, STATUS_NO_SLIDE))
+
+    def _solve_batch_step(self, cases):
+
+        dt = self.dt
+        g = self.g
+        theta_rad = cases['theta']*np.pi/180.
+        k_ramp = g*(np.sin(theta_rad) - (cases['u_r']*np.cos(theta_rad)))
+        slide = k_ramp > 0.
+
+        cases['status'] = STATUS_NO_SLIDE
+        cases['v_exit'] = 0.
+        cases['t_exit'] = 0.
+        cases['t_stop'] = 0.
+        cases['distance'] = -1.*cases['slope_length']
+
+        # working set of the cases still moving, compacted whenever some of them finish
+        idx = np.flatnonzero(slide)
+        k = k_ramp[idx]
+        gamma = (cases['c']/cases['m'])[idx]
+        u_f = cases['u_f'][idx]
+        s = -1.*cases['slope_length'][idx]
+        v = np.zeros(idx.size)
+        t = np.zeros(idx.size)
+        on_ramp = np.ones(idx.size, dtype=bool)
+        steps = 0
+        while idx.size > 0:
+            if steps >= self.max_steps:
+                cases['status'][idx] = STATUS_MAX_STEPS
+                cases['t_stop'][idx] = t
+                cases['distance'][idx] = s
+                break
+            steps = steps + 1
+
+            # ramp: rectangle rule over the analytic ramp speed, as in run()
+            if on_ramp.any():
+                vi = phase_state(t, 0., k, gamma)[0]
+                s = np.where(on_ramp, s + vi*dt, s)
+                v = np.where(on_ramp, vi, v)
+                exited = on_ramp & (s >= 0.)
+                cases['v_exit'][idx[exited]] = v[exited]
+                cases['t_exit'][idx[exited]] = t[exited]
+                t = np.where(on_ramp, t + dt, t)
+                floor = ~on_ramp
+                on_ramp = on_ramp & ~exited
+            else:
+                floor = np.ones(idx.size, dtype=bool)
+
+            # floor: subtract friction and drag energy over the step, as in run()
+            t = np.where(floor, t + dt, t)
+            v2 = v*v - 2.*(u_f*g + gamma*v*v)*v*dt
+            v = np.where(floor, np.sqrt(np.maximum(v2, 0.)), v)
+            s = np.where(floor, s + v*dt, s)
+
+            stopped = floor & (v <= 0.)
+            limit = floor & (s > self.floor_limit)
+            done = stopped | limit
+            if done.any():
+                cases['status'][idx[stopped]] = STATUS_STOPPED
+                cases['status'][idx[limit]] = STATUS_FLOOR_LIMIT
+                cases['t_stop'][idx[done]] = t[done]
+                cases['distance'][idx[done]] = s[done]
+                keep = ~done
+                idx = idx[keep]
+                k = k[keep]
+                gamma = gamma[keep]
+                u_f = u_f[keep]
+                s = s[keep]
+                v = v[keep]
+                t = t[keep]
+                on_ramp = on_ramp[keep]
 
 # rr = RampRoll()
 # rr.set_car_mass(0.5)
@@ -0,0 +1,174 @@
+# Result cache for RampRoll runs
+# Memoizes trajectories and summaries keyed on the (quantized) simulation parameters,
+# in memory with an LRU size cap and optionally on disk so results survive across sessions.
+import os
+import shelve
+import hashlib
+import collections
+import numpy as np
+
+# RampRoll attributes that make up a cache key, together with the slope length and the engine
+CACHE_KEY_FIELDS = ('m', 'theta', 'u_r', 'u_f', 'c', 'dt', 'floor_limit', 'g', 'rtol', 'atol')
+# engines that return (va, sa, ta)
+CACHE_ENGINES = ('run', 'run_vectorized', 'run_adaptive')
+# RampRoll.run_summary engine with the same steps as the trajectory engine, summary() misses use it so no
+# trajectory is allocated (run_adaptive keeps few samples and is summarized from its trajectory)
+SUMMARY_ENGINES = {'run': 'step', 'run_vectorized': 'vectorized'}
+
+
+class ResultCache:
+
+    def __init__(self, max_bytes=256*2**20, max_summaries=100000, disk_dir=None, digits=9):
+
+        # parameters are rounded to this many significant digits, near identical runs share an entry
+        self.digits = digits
+        self.max_bytes = max_bytes
+        self.max_summaries = max_summaries
+        self.trajectories = collections.OrderedDict()
+        self.summaries = collections.OrderedDict()
+        self.n_bytes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'summary_hits': 0, 'summary_misses': 0,
+                      'disk_hits': 0, 'evictions': 0}
+        self.disk_dir = disk_dir
+        # shelf of the disk summaries, opened on first use and kept open until close()
+        self.db = None
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def make_key(self, rr_obj, slope_length, engine='run'):
+
+        values = [getattr(rr_obj, name) for name in CACHE_KEY_FIELDS] + [slope_length]
+        return (engine,) + tuple(float('%.*g' % (self.digits, x)) for x in values)
+
+    def _disk_name(self, key) -> str:
+        return hashlib.sha1(repr(key).encode()).hexdigest()
+
+    # ========== full trajectories ==========
+
+    # (va, sa, ta) of rr_obj.<engine>(slope_length) as read-only numpy arrays, computed only on a miss
+    def run(self, rr_obj, slope_length=5, engine='run'):
+
+        if engine not in CACHE_ENGINES:
+            raise ValueError('Unknown engine %r' % engine)
+        key = self.make_key(rr_obj, slope_length, engine)
+        if key in self.trajectories:
+            self.trajectories.move_to_end(key)
+            self.stats['hits'] = self.stats['hits'] + 1
+            return self.trajectories[key]
+
+        result = self._load_trajectory(key)
+        if result is not None:
+            self.stats['disk_hits'] = self.stats['disk_hits'] + 1
+        else:
+            self.stats['misses'] = self.stats['misses'] + 1
+            va, sa, ta = getattr(rr_obj, engine)(slope_length)
+            result = tuple(np.array(x, dtype=float) for x in (va, sa, ta))
+            self._save_trajectory(key, result)
+        for x in result:
+            x.setflags(write=False)
+
+        self.trajectories[key] = result
+        self.n_bytes = self.n_bytes + sum(x.nbytes for x in result)
+        self._store_summary(key, self._summary_from_trajectory(result))
+        while self.n_bytes > self.max_bytes and len(self.trajectories) > 1:
+            old_key, old = self.trajectories.popitem(last=False)
+            self.n_bytes = self.n_bytes - sum(x.nbytes for x in old)
+            self.stats['evictions'] = self.stats['evictions'] + 1
+        return result
+
+    def _load_trajectory(self, key):
+
+        if self.disk_dir is None:
+            return None
+        path = os.path.join(self.disk_dir, self._disk_name(key) + '.npz')
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as f:
+                return f['va'], f['sa'], f['ta']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _save_trajectory(self, key, result):
+
+        if self.disk_dir is None:
+            return
+        path = os.path.join(self.disk_dir, self._disk_name(key) + '.npz')
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, va=result[0], sa=result[1], ta=result[2])
+        os.replace(tmp_path, path)
+
+    # ========== summaries only ==========
+
+    @staticmethod
+    def _summary_from_trajectory(result):
+        va, sa, ta = result
+        return {'distance': float(sa[-1]), 't_stop': float(ta[-1]), 'v_end': float(va[-1])}
+
+    # {'distance', 't_stop', 'v_end'} of a run, without keeping the trajectory on a miss
+    def summary(self, rr_obj, slope_length=5, engine='run'):
+
+        if engine not in CACHE_ENGINES:
+            raise ValueError('Unknown engine %r' % engine)
+        key = self.make_key(rr_obj, slope_length, engine)
+        if key in self.summaries:
+            self.summaries.move_to_end(key)
+            self.stats['summary_hits'] = self.stats['summary_hits'] + 1
+            return dict(self.summaries[key])
+
+        summary = self._load_summary(key)
+        if summary is not None:
+            self.stats['disk_hits'] = self.stats['disk_hits'] + 1
+        elif key in self.trajectories:
+            self.stats['summary_hits'] = self.stats['summary_hits'] + 1
+            summary = self._summary_from_trajectory(self.trajectories[key])
+        else:
+            self.stats['summary_misses'] = self.stats['summary_misses'] + 1
+            if engine in SUMMARY_ENGINES:
+                result = rr_obj.run_summary(slope_length, engine=SUMMARY_ENGINES[engine])
+                summary = {name: result[name] for name in ('distance', 't_stop', 'v_end')}
+            else:
+                summary = self._summary_from_trajectory(getattr(rr_obj, engine)(slope_length))
+        self._store_summary(key, summary)
+        return dict(summary)
+
+    def _store_summary(self, key, summary: dict):
+
+        self.summaries[key] = summary
+        self.summaries.move_to_end(key)
+        while len(self.summaries) > self.max_summaries:
+            self.summaries.popitem(last=False)
+            self.stats['evictions'] = self.stats['evictions'] + 1
+        if self.disk_dir is not None:
+            self._open_db()[self._disk_name(key)] = summary
+
+    def _load_summary(self, key):
+
+        if self.disk_dir is None:
+            return None
+        return self._open_db().get(self._disk_name(key))
+
+    def _open_db(self):
+
+        if self.db is None:
+            self.db = shelve.open(os.path.join(self.disk_dir, 'summaries'))
+        return self.db
+
+    # write the disk summaries out and close the shelf, it is opened again on the next disk access
+    def close(self):
+
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def clear(self):
+
+        self.trajectories.clear()
+        self.summaries.clear()
+        self.n_bytes = 0
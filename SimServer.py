@@ -0,0 +1,342 @@
+# Local simulation service - HTTP/JSON front end of the headless RampRoll core
+#   POST /predict  one record {"m": 1, "theta": 30, ...} or a list of records, fields as in --batch
+#                  (missing fields take the RampRoll defaults), answers with the --batch result fields
+#   GET  /stats    request / batch counters and the per request latency histogram
+#   GET  /health
+# Concurrent requests are queued and coalesced into vectorized micro-batches by one batcher thread, which
+# hands them to a bounded process pool (SweepRunner.run_chunk). A full queue answers 503 (backpressure).
+# Started with: python MainControl.py --serve [--port 8765] [--workers 2]
+import sys
+import json
+import signal
+import time
+import queue
+import threading
+import argparse
+import collections
+import concurrent.futures as cf
+import http.server
+import numpy as np
+import RampRoll as RampRoll
+import SweepRunner as SweepRunner
+import BatchCli as BatchCli
+
+
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8765
+# the batcher waits this long after the first queued request for more requests to join the batch
+BATCH_WINDOW_S = 0.002
+MAX_BATCH_CASES = 4096
+# queued requests before new ones are refused with 503
+MAX_QUEUED_REQUESTS = 1024
+MAX_BODY_BYTES = 16*2**20
+REQUEST_TIMEOUT_S = 30.
+# upper bucket bounds (ms) of the latency histogram, the last bucket is open ended
+LATENCY_BUCKETS_MS = (0.1, 0.2, 0.5, 1., 2., 5., 10., 20., 50., 100., 200., 500., 1000., 2000., 5000.)
+# recent latencies kept for the percentiles in /stats
+LATENCY_WINDOW = 10000
+
+
+class LatencyHistogram:
+
+    def __init__(self):
+
+        self.lock = threading.Lock()
+        self.counts = [0]*(len(LATENCY_BUCKETS_MS) + 1)
+        self.recent = collections.deque(maxlen=LATENCY_WINDOW)
+        self.n = 0
+        self.total = 0.
+
+    def record(self, seconds: float):
+
+        ms = 1e3*seconds
+        i = int(np.searchsorted(LATENCY_BUCKETS_MS, ms))
+        with self.lock:
+            self.counts[i] = self.counts[i] + 1
+            self.recent.append(ms)
+            self.n = self.n + 1
+            self.total = self.total + ms
+
+    def snapshot(self) -> dict:
+
+        with self.lock:
+            counts = list(self.counts)
+            recent = np.array(self.recent)
+            n = self.n
+            total = self.total
+        buckets = [{'le_ms': le, 'count': count} for le, count in zip(LATENCY_BUCKETS_MS + (None,), counts)]
+        result = {'count': n, 'mean_ms': total/n if n else None, 'buckets': buckets}
+        for q in (50, 90, 99):
+            result['p%d_ms' % q] = float(np.percentile(recent, q)) if len(recent) else None
+        return result
+
+
+# Coalesces the cases of concurrent requests into one BATCH_DTYPE array per batch.
+# workers=0 evaluates the batches on the batcher thread itself, otherwise at most 2*workers batches are
+# in the process pool at a time; while the pool is busy the queue fills up and submit() raises queue.Full.
+class MicroBatcher:
+
+    def __init__(self, settings: dict, method='analytic', workers=0, window_s=BATCH_WINDOW_S,
+                 max_batch=MAX_BATCH_CASES, max_queue=MAX_QUEUED_REQUESTS):
+
+        self.settings = settings
+        self.method = method
+        self.window_s = window_s
+        self.max_batch = max_batch
+        self.queue = queue.Queue(max_queue)
+        self.pool = cf.ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+        self.slots = threading.BoundedSemaphore(2*workers) if workers > 0 else None
+        self.n_batches = 0
+        self.n_cases = 0
+        self.max_batch_seen = 0
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    # queue the cases of one request, the future gets them back with the results filled in
+    def submit(self, cases):
+
+        future = cf.Future()
+        self.queue.put_nowait((cases, future))
+        return future
+
+    def work(self):
+
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            batch = [item]
+            n = len(item[0])
+            deadline = time.monotonic() + self.window_s
+            while n < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0.:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.queue.put(None)
+                    break
+                batch.append(item)
+                n = n + len(item[0])
+
+            self.n_batches = self.n_batches + 1
+            self.n_cases = self.n_cases + n
+            self.max_batch_seen = max(self.max_batch_seen, n)
+            cases = np.concatenate([x[0] for x in batch])
+            futures = [x[1] for x in batch]
+            sizes = [len(x[0]) for x in batch]
+            if self.pool is None:
+                self.deliver(futures, sizes, cases)
+            else:
+                self.slots.acquire()
+                job = self.pool.submit(SweepRunner.run_chunk, cases, self.settings, self.method)
+                job.add_done_callback(lambda job, futures=futures, sizes=sizes: self.finish_job(job, futures, sizes))
+
+    def finish_job(self, job, futures, sizes):
+
+        self.slots.release()
+        try:
+            cases = job.result()
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        self.split(futures, sizes, cases)
+
+    def deliver(self, futures, sizes, cases):
+
+        try:
+            cases = SweepRunner.run_chunk(cases, self.settings, self.method)
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        self.split(futures, sizes, cases)
+
+    @staticmethod
+    def split(futures, sizes, cases):
+
+        i = 0
+        for future, n in zip(futures, sizes):
+            future.set_result(cases[i:i + n])
+            i = i + n
+
+    def stats(self) -> dict:
+        return {'batches': self.n_batches, 'cases': self.n_cases, 'max_batch': self.max_batch_seen,
+                'mean_batch': self.n_cases/self.n_batches if self.n_batches else None,
+                'queued': self.queue.qsize()}
+
+    def close(self):
+
+        self.queue.put(None)
+        self.thread.join()
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+# result record of one case, the same fields as the JSONL output of --batch (nan as null)
+def case_record(case) -> dict:
+
+    record = {}
+    for name in RampRoll.BATCH_DTYPE.names:
+        x = case[name].item()
+        record[name] = x if name == 'status' or np.isfinite(x) else None
+    record['status_name'] = RampRoll.STATUS_NAMES[record['status']]
+    return record
+
+
+class SimRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes, without this every keep-alive response waits for a
+    # delayed ACK (~40 ms)
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, code: int, obj, headers=()):
+
+        body = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        elif self.path == '/stats':
+            with self.server.lock:
+                n_requests = self.server.n_requests
+                n_rejected = self.server.n_rejected
+            self.send_json(200, {'requests': n_requests, 'rejected': n_rejected,
+                                 'batcher': self.server.batcher.stats(),
+                                 'latency': self.server.latency.snapshot()})
+        else:
+            self.send_json(404, {'error': 'unknown path %s' % self.path})
+
+    def do_POST(self):
+
+        t0 = time.perf_counter()
+        if self.path != '/predict':
+            self.send_json(404, {'error': 'unknown path %s' % self.path})
+            return
+        length = self.headers.get('Content-Length')
+        if length is None:
+            self.send_json(411, {'error': 'Content-Length required'}, [('Connection', 'close')])
+            self.close_connection = True
+            return
+        try:
+            size = int(length)
+        except ValueError:
+            size = -1
+        if size < 0:
+            # the body cannot be found in the stream, so the connection cannot be reused either
+            self.send_json(400, {'error': 'invalid Content-Length %r' % length}, [('Connection', 'close')])
+            self.close_connection = True
+            return
+        if size > MAX_BODY_BYTES:
+            self.send_json(413, {'error': 'request body larger than %d bytes' % MAX_BODY_BYTES},
+                           [('Connection', 'close')])
+            self.close_connection = True
+            return
+        try:
+            data = json.loads(self.rfile.read(size))
+            records = data if isinstance(data, list) else [data]
+            if not records or not all(isinstance(x, dict) for x in records):
+                raise ValueError('expected a JSON object or a non-empty list of objects')
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+
+        cases = next(BatchCli.iter_case_blocks(records, self.server.rr_obj, len(records)))
+        try:
+            future = self.server.batcher.submit(cases)
+        except queue.Full:
+            with self.server.lock:
+                self.server.n_rejected = self.server.n_rejected + 1
+            self.send_json(503, {'error': 'server busy'}, [('Retry-After', '1')])
+            return
+        try:
+            cases = future.result(timeout=REQUEST_TIMEOUT_S)
+        except Exception as e:
+            self.send_json(500, {'error': str(e) or type(e).__name__})
+            return
+        results = [case_record(case) for case in cases]
+        self.send_json(200, results if isinstance(data, list) else results[0])
+        with self.server.lock:
+            self.server.n_requests = self.server.n_requests + 1
+        self.server.latency.record(time.perf_counter() - t0)
+
+
+class SimServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, rr_obj, method='analytic', workers=0, window_s=BATCH_WINDOW_S,
+                 max_batch=MAX_BATCH_CASES, max_queue=MAX_QUEUED_REQUESTS):
+
+        super().__init__(address, SimRequestHandler)
+        self.rr_obj = rr_obj
+        settings = {name: getattr(rr_obj, name) for name in SweepRunner.SWEEP_SETTINGS}
+        self.batcher = MicroBatcher(settings, method, workers, window_s, max_batch, max_queue)
+        self.latency = LatencyHistogram()
+        # request counters, updated by the handler threads
+        self.lock = threading.Lock()
+        self.n_requests = 0
+        self.n_rejected = 0
+
+    def server_close(self):
+
+        super().server_close()
+        self.batcher.close()
+
+
+def make_parser():
+
+    parser = argparse.ArgumentParser(prog='MainControl.py --serve',
+                                     description='Local HTTP/JSON Ramp and Roll simulation service')
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--workers', type=int, default=0,
+                        help='worker processes, 0 evaluates the batches in the server process')
+    parser.add_argument('--method', choices=('analytic', 'step'), default='analytic')
+    parser.add_argument('--window-ms', type=float, default=1e3*BATCH_WINDOW_S,
+                        help='time a batch waits for more requests (ms)')
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH_CASES, help='cases per batch')
+    parser.add_argument('--max-queue', type=int, default=MAX_QUEUED_REQUESTS,
+                        help='queued requests before answering 503')
+    parser.add_argument('--dt', type=float, default=None, help='simulation delta t (s)')
+    parser.add_argument('--floor-limit', type=float, default=None, help='floor limit (m)')
+    return parser
+
+
+def run_server_cli(argv=None) -> int:
+
+    args = make_parser().parse_args(argv)
+    rr = RampRoll.RampRoll()
+    if args.dt is not None:
+        rr.set_sim_delta_t(args.dt)
+    if args.floor_limit is not None:
+        rr.set_floor_limit(args.floor_limit)
+
+    server = SimServer((args.host, args.port), rr, args.method, max(args.workers, 0), 1e-3*args.window_ms,
+                       max(args.max_batch, 1), max(args.max_queue, 1))
+    # SIGTERM (e.g. from LoadGen --spawn) stops like Ctrl-C, so server_close() shuts the worker pool down.
+    # shutdown() waits for serve_forever() to return, so it cannot run on the main thread inside the handler.
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    print('Serving on http://%s:%d' % server.server_address[:2], file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
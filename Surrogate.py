@@ -0,0 +1,225 @@
+# Final distance surrogate
+# Precomputes RampRoll final distances on a grid over (m, theta, u_r, u_f, c, slope_length), keeps the grid
+# in a memory-mapped .npy and answers queries by multilinear interpolation with an error estimate.
+# Queries outside the grid or with a too large error estimate fall back to a real simulation.
+# A vectorized query costs about as much as a few solve_batch('analytic') cases, so the surrogate pays off
+# when the fallback is the 'step' method; next to 'analytic' call solve_batch directly.
+import os
+import json
+import itertools
+import numpy as np
+import RampRoll as RampRoll
+
+# The error estimate is scaled by the largest actual / estimated error ratio seen on random held-out points
+# at build time times CALIBRATION_MARGIN, but never by less than ERROR_SAFETY_FACTOR.
+ERROR_SAFETY_FACTOR = 2.
+CALIBRATION_MARGIN = 1.5
+CALIBRATION_POINTS = 2000
+
+
+# Largest |second difference| along every axis with more than one node, over every corner of each cell.
+# Shape (cells..., axes with more than one node), float32. Axes with only two nodes have no node triple to
+# estimate it from, and cells whose corners do not all end the same way (e.g. stopped / no_slide) are not
+# smooth; both get inf.
+def cell_curvature(axes, distance, status):
+
+    distance = np.asarray(distance, dtype=float)
+    status = np.asarray(status, dtype=int)
+    active = [d for d, x in enumerate(axes) if len(x) > 1]
+    cell_shape = tuple(max(len(x) - 1, 1) for x in axes)
+    curvature = np.empty(cell_shape + (len(active),), dtype=np.float32)
+
+    # node values -> largest value over the corners of every cell
+    def cell_max(a):
+        for d in active:
+            n = len(axes[d])
+            a = np.maximum(a.take(np.arange(n - 1), axis=d), a.take(np.arange(1, n), axis=d))
+        return a
+
+    mixed = cell_max(status) != -cell_max(-status)
+    for k, d in enumerate(active):
+        x = axes[d]
+        n = len(x)
+        if n < 3:
+            curvature[..., k] = np.inf
+            continue
+        shape = [1]*distance.ndim
+        shape[d] = n - 2
+        x0, x1, x2 = [x[j:n - 2 + j].reshape(shape) for j in range(3)]
+        f0, f1, f2 = [distance.take(np.arange(j, n - 2 + j), axis=d) for j in range(3)]
+        with np.errstate(all='ignore'):
+            node = np.abs(2.*((f2 - f1)/(x2 - x1) - (f1 - f0)/(x1 - x0))/(x2 - x0))
+        # the end nodes take the second difference of their neighbour
+        node = node.take(np.clip(np.arange(n) - 1, 0, n - 3), axis=d)
+        curvature[..., k] = cell_max(np.where(np.isnan(node), np.inf, node))
+    curvature[mixed] = np.inf
+    return curvature
+
+
+class DistanceSurrogate:
+
+    def __init__(self, axes, distance, status, settings: dict, method='analytic', curvature=None,
+                 safety_factor=ERROR_SAFETY_FACTOR):
+
+        # one sorted 1-d array per BATCH_INPUTS name, a single value pins that parameter
+        self.axes = [np.asarray(x, dtype=float) for x in axes]
+        self.distance = distance
+        self.status = status
+        self.settings = settings
+        self.method = method
+        self.curvature = curvature if curvature is not None else cell_curvature(self.axes, distance, status)
+        self.safety_factor = safety_factor
+        self.n_queries = 0
+        self.n_fallbacks = 0
+
+        # flat strides of the node and cell grids, and the flat offsets of the 2**k corners of a cell
+        shape = tuple(len(x) for x in self.axes)
+        cell_shape = self.curvature.shape[:-1]
+        self.node_strides = [int(np.prod(shape[d + 1:], dtype=int)) for d in range(len(shape))]
+        self.cell_strides = [int(np.prod(cell_shape[d + 1:], dtype=int)) for d in range(len(shape))]
+        active = [d for d, x in enumerate(self.axes) if len(x) > 1]
+        corner_bits = np.array(list(itertools.product((0, 1), repeat=len(active))), dtype=int)
+        corner_bits = corner_bits.reshape(-1, len(active))
+        self.corner_offsets = corner_bits @ np.array([self.node_strides[d] for d in active], dtype=int)
+        self.flat_distance = self.distance.reshape(-1)
+        self.flat_curvature = self.curvature.reshape(-1, len(active))
+
+    # Evaluate the grid with RampRoll.solve_batch, axes is a dict name -> values for BATCH_INPUTS names.
+    # With path given the grids are written straight into memory-mapped path.npy / path_status.npy
+    # (and path_curvature.npy).
+    @classmethod
+    def build(cls, rr_obj, axes: dict, method='analytic', path=None, chunk_size=100000):
+
+        axes = [np.unique(np.asarray(axes[name], dtype=float)) for name in RampRoll.BATCH_INPUTS]
+        shape = tuple(len(x) for x in axes)
+        if path is None:
+            distance = np.empty(shape)
+            status = np.empty(shape, dtype='i1')
+        else:
+            distance = np.lib.format.open_memmap(path + '.npy', mode='w+', dtype='f8', shape=shape)
+            status = np.lib.format.open_memmap(path + '_status.npy', mode='w+', dtype='i1', shape=shape)
+
+        flat_distance = distance.reshape(-1)
+        flat_status = status.reshape(-1)
+        n = flat_distance.size
+        for start in range(0, n, chunk_size):
+            index = np.unravel_index(np.arange(start, min(start + chunk_size, n)), shape)
+            cases = RampRoll.batch_cases(*[x[i] for x, i in zip(axes, index)])
+            rr_obj.solve_batch(cases, method)
+            flat_distance[start:start + len(cases)] = cases['distance']
+            flat_status[start:start + len(cases)] = cases['status']
+
+        curvature = cell_curvature(axes, distance, status)
+        if path is not None:
+            distance.flush()
+            status.flush()
+            np.save(path + '_curvature.npy', curvature)
+            curvature = np.load(path + '_curvature.npy', mmap_mode='r')
+        settings = {'g': rr_obj.g, 'dt': rr_obj.dt, 'floor_limit': rr_obj.floor_limit}
+        surrogate = cls(axes, distance, status, settings, method, curvature)
+        surrogate.calibrate(rr_obj)
+        if path is not None:
+            surrogate.save_axes(path)
+        return surrogate
+
+    # Set safety_factor from the error of the interpolation at random points inside the grid, simulated
+    # with rr_obj. Returns the largest actual / estimated error ratio seen.
+    def calibrate(self, rr_obj, n_points=CALIBRATION_POINTS, seed=0):
+
+        rng = np.random.default_rng(seed)
+        points = [rng.uniform(x[0], x[-1], n_points) for x in self.axes]
+        distance, error, inside = self.query(*points)
+        cases = rr_obj.solve_batch(RampRoll.batch_cases(*points), self.method)
+        with np.errstate(all='ignore'):
+            ratio = np.abs(distance - cases['distance'])/(error/self.safety_factor)
+        ratio = ratio[np.isfinite(ratio)]
+        worst = float(ratio.max()) if len(ratio) else 0.
+        self.safety_factor = max(ERROR_SAFETY_FACTOR, CALIBRATION_MARGIN*worst)
+        return worst
+
+    def save_axes(self, path):
+
+        with open(path + '.json', 'w') as f:
+            json.dump({'axes': {name: x.tolist() for name, x in zip(RampRoll.BATCH_INPUTS, self.axes)},
+                       'settings': self.settings, 'method': self.method, 'safety_factor': self.safety_factor},
+                      f, indent=1)
+
+    def save(self, path):
+
+        np.save(path + '.npy', np.asarray(self.distance))
+        np.save(path + '_status.npy', np.asarray(self.status))
+        np.save(path + '_curvature.npy', np.asarray(self.curvature))
+        self.save_axes(path)
+
+    # the grids stay on disk and are paged in as queries touch them
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+
+        with open(path + '.json') as f:
+            meta = json.load(f)
+        axes = [meta['axes'][name] for name in RampRoll.BATCH_INPUTS]
+        distance = np.load(path + '.npy', mmap_mode=mmap_mode)
+        status = np.load(path + '_status.npy', mmap_mode=mmap_mode)
+        # older grids without the curvature file get it recomputed
+        curvature = np.load(path + '_curvature.npy', mmap_mode=mmap_mode) \
+            if os.path.exists(path + '_curvature.npy') else None
+        return cls(axes, distance, status, meta['settings'], meta['method'], curvature,
+                   meta.get('safety_factor', ERROR_SAFETY_FACTOR))
+
+    # Multilinear interpolation of the final distance.
+    # Parameters broadcast like batch_cases. Returns (distance, error estimate, inside grid).
+    # The error estimate is safety_factor times 0.5*max|f''|*(x - x_i)*(x_i+1 - x) summed over the axes,
+    # with the largest second difference over all corners of the cell (see cell_curvature). It is inf inside
+    # cells whose corners do not all end the same way and inside cells of axes with only two nodes.
+    def query(self, m, theta, u_r, u_f, c, slope_length):
+
+        points = [np.asarray(x, dtype=float) for x in np.broadcast_arrays(m, theta, u_r, u_f, c, slope_length)]
+        shape = points[0].shape
+        inside = np.ones(shape, dtype=bool)
+        node = np.zeros(shape, dtype=int)
+        cell = np.zeros(shape, dtype=int)
+        weights = []
+        spans = []
+        for x, p, node_stride, cell_stride in zip(self.axes, points, self.node_strides, self.cell_strides):
+            if len(x) == 1:
+                inside &= p == x[0]
+                continue
+            inside &= (p >= x[0]) & (p <= x[-1])
+            i = np.clip(np.searchsorted(x, p, side='right') - 1, 0, len(x) - 2)
+            node = node + i*node_stride
+            cell = cell + i*cell_stride
+            weights.append(np.clip((p - x[i])/(x[i + 1] - x[i]), 0., 1.))
+            spans.append(0.5*np.abs((p - x[i])*(x[i + 1] - p)))
+
+        # gather all 2**k corners of the cell at once, then interpolate one axis at a time (the last axis
+        # varies fastest in corner_offsets), halving the corner values each time
+        distance = self.flat_distance[node[..., np.newaxis] + self.corner_offsets]
+        for wd in reversed(weights):
+            distance = distance.reshape(shape + (-1, 2))
+            distance = distance[..., 0] + wd[..., np.newaxis]*(distance[..., 1] - distance[..., 0])
+        distance = distance.reshape(shape)
+
+        curvature = self.flat_curvature[cell]
+        error = np.zeros(shape)
+        with np.errstate(invalid='ignore'):
+            for k, span in enumerate(spans):
+                # exact on the nodes of an axis, whatever the curvature
+                error = error + np.where(span > 0., curvature[..., k]*span, 0.)
+        return distance, self.safety_factor*error, inside
+
+    # Final distance for the given parameters, interpolated where the grid is good enough (error <= tol)
+    # and simulated with rr_obj.solve_batch everywhere else.
+    def predict(self, rr_obj, m, theta, u_r, u_f, c, slope_length, tol=1e-3):
+
+        distance, error, inside = self.query(m, theta, u_r, u_f, c, slope_length)
+        distance = np.array(distance, dtype=float)
+        error = np.array(error, dtype=float)
+        fallback = ~inside | (error > tol)
+        self.n_queries = self.n_queries + distance.size
+        if fallback.any():
+            params = [np.broadcast_to(x, distance.shape)[fallback] for x in (m, theta, u_r, u_f, c, slope_length)]
+            cases = rr_obj.solve_batch(RampRoll.batch_cases(*params), self.method)
+            distance[fallback] = cases['distance']
+            error[fallback] = 0.
+            self.n_fallbacks = self.n_fallbacks + int(fallback.sum())
+        return distance, error
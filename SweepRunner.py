@@ -0,0 +1,210 @@
+# Sweep Runner - runs large RampRoll parameter sweeps in chunks on a process pool
+# Finished chunks are saved as .npz files so an interrupted sweep resumes where it stopped.
+import os
+import json
+import concurrent.futures as cf
+import numpy as np
+import RampRoll as RampRoll
+
+
+# settings copied from the RampRoll object into every worker
+SWEEP_SETTINGS = ('g', 'dt', 'floor_limit', 'max_steps')
+# result fields set to nan for cases that failed
+RESULT_FIELDS = ('v_exit', 't_exit', 't_stop', 'distance')
+# a chunk whose worker process died is resubmitted this many times on a fresh pool (the crash may have been
+# caused by another chunk) before it is reported as failed
+SWEEP_RETRIES = 1
+
+
+# Cases the physics is defined for: finite inputs, positive mass, no negative frictions, drag or slope length.
+# The solvers do not check this themselves and the methods disagree on such inputs.
+def valid_inputs(cases):
+
+    valid = (cases['m'] > 0.) & (cases['u_r'] >= 0.) & (cases['u_f'] >= 0.) & (cases['c'] >= 0.) \
+        & (cases['slope_length'] >= 0.)
+    for name in RampRoll.BATCH_INPUTS:
+        valid &= np.isfinite(cases[name])
+    return valid
+
+
+# Worker entry point, only takes picklable arrays and floats and never touches the GUI.
+# If the whole chunk fails, the cases are retried one by one and the failing ones get STATUS_ERROR.
+def run_chunk(cases, settings: dict, method='analytic'):
+
+    rr = RampRoll.RampRoll()
+    for name, value in settings.items():
+        setattr(rr, name, value)
+
+    with np.errstate(all='ignore'):
+        # bad inputs are never solved, the step method would not finish on some of them
+        valid = valid_inputs(cases)
+        todo = cases[valid] if not valid.all() else cases
+        try:
+            rr.solve_batch(todo, method)
+        except Exception:
+            for i in range(len(todo)):
+                try:
+                    rr.solve_batch(todo[i:i + 1], method)
+                except Exception:
+                    todo['status'][i] = RampRoll.STATUS_ERROR
+        if todo is not cases:
+            cases[valid] = todo
+
+        bad = ~(valid & np.isfinite(cases['distance']) & np.isfinite(cases['v_exit']))
+        cases['status'][bad] = RampRoll.STATUS_ERROR
+        failed = cases['status'] == RampRoll.STATUS_ERROR
+        for name in RESULT_FIELDS:
+            cases[name][failed] = np.nan
+
+    return cases
+
+
+class SweepRunner:
+
+    def __init__(self, rr_obj, out_dir: str, chunk_size=100000, workers=None, method='analytic'):
+
+        self.out_dir = out_dir
+        self.chunk_size = chunk_size
+        self.workers = workers if workers else os.cpu_count()
+        self.method = method
+        self.settings = {name: getattr(rr_obj, name) for name in SWEEP_SETTINGS}
+        # number of chunks computed / reused from disk / lost with their worker process by the last run()
+        self.n_computed = 0
+        self.n_resumed = 0
+        self.n_failed = 0
+
+    def chunk_path(self, i: int) -> str:
+        return os.path.join(self.out_dir, 'chunk_%06d.npz' % i)
+
+    def manifest_path(self) -> str:
+        return os.path.join(self.out_dir, 'sweep.json')
+
+    # A chunk on disk is reused only if it was made with the same settings and the same input rows.
+    def load_chunk(self, i: int, cases):
+
+        path = self.chunk_path(i)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as f:
+                saved = f['cases']
+        except (OSError, ValueError, KeyError):
+            return None
+        if saved.dtype != cases.dtype or len(saved) != len(cases):
+            return None
+        for name in RampRoll.BATCH_INPUTS:
+            if not np.array_equal(saved[name], cases[name], equal_nan=True):
+                return None
+        return saved
+
+    # write to a temporary file first so a killed job never leaves a half written chunk behind
+    def save_chunk(self, i: int, cases):
+
+        path = self.chunk_path(i)
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, cases=cases)
+        os.replace(tmp_path, path)
+
+    def write_manifest(self, n_cases: int):
+
+        manifest = {'n_cases': n_cases, 'chunk_size': self.chunk_size,
+                    'method': self.method, 'settings': self.settings}
+        manifest_path = self.manifest_path()
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                if json.load(f) != manifest:
+                    # different sweep in the same directory, none of the old chunks can be trusted
+                    for name in os.listdir(self.out_dir):
+                        if name.startswith('chunk_') and name.endswith('.npz'):
+                            os.remove(os.path.join(self.out_dir, name))
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=1)
+
+    # Run all cases (a BATCH_DTYPE array, see RampRoll.batch_cases) and return them with results filled in.
+    # progress(done_chunks, total_chunks) is called in the parent process after every chunk.
+    def run(self, cases, progress=None):
+
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.write_manifest(len(cases))
+        n_chunks = (len(cases) + self.chunk_size - 1)//self.chunk_size
+        results = cases.copy()
+        self.n_computed = 0
+        self.n_resumed = 0
+        self.n_failed = 0
+
+        todo = []
+        for i in range(n_chunks):
+            chunk = results[i*self.chunk_size:(i + 1)*self.chunk_size]
+            saved = self.load_chunk(i, chunk)
+            if saved is None:
+                todo.append(i)
+            else:
+                chunk[...] = saved
+                self.n_resumed = self.n_resumed + 1
+        if progress is not None:
+            progress(self.n_resumed, n_chunks)
+
+        # Keep a bounded number of chunks in flight so memory does not grow with the sweep size.
+        # When a worker process dies the pool breaks and every chunk in flight fails with it: the pool is
+        # replaced and those chunks are resubmitted up to SWEEP_RETRIES times. Chunks that still fail are
+        # reported as STATUS_ERROR / nan but never saved, so the next run() computes them again.
+        pool = cf.ProcessPoolExecutor(max_workers=self.workers)
+        generation = 0
+        attempts = {}
+        try:
+            pending = {}
+            next_todo = 0
+            while next_todo < len(todo) or pending:
+                while next_todo < len(todo) and len(pending) < 2*self.workers:
+                    i = todo[next_todo]
+                    chunk = results[i*self.chunk_size:(i + 1)*self.chunk_size]
+                    try:
+                        future = pool.submit(run_chunk, chunk.copy(), self.settings, self.method)
+                    except cf.process.BrokenProcessPool:
+                        pool.shutdown(wait=False)
+                        pool = cf.ProcessPoolExecutor(max_workers=self.workers)
+                        generation = generation + 1
+                        continue
+                    pending[future] = (i, generation)
+                    next_todo = next_todo + 1
+                finished, _ = cf.wait(pending, return_when=cf.FIRST_COMPLETED)
+                for future in finished:
+                    i, future_generation = pending.pop(future)
+                    chunk = results[i*self.chunk_size:(i + 1)*self.chunk_size]
+                    try:
+                        chunk[...] = future.result()
+                    except Exception as e:
+                        if isinstance(e, cf.process.BrokenProcessPool) and future_generation == generation:
+                            pool.shutdown(wait=False)
+                            pool = cf.ProcessPoolExecutor(max_workers=self.workers)
+                            generation = generation + 1
+                        attempts[i] = attempts.get(i, 0) + 1
+                        if attempts[i] <= SWEEP_RETRIES:
+                            todo.append(i)
+                            continue
+                        chunk['status'] = RampRoll.STATUS_ERROR
+                        for name in RESULT_FIELDS:
+                            chunk[name] = np.nan
+                        self.n_failed = self.n_failed + 1
+                    else:
+                        self.save_chunk(i, chunk)
+                        self.n_computed = self.n_computed + 1
+                    if progress is not None:
+                        progress(self.n_resumed + self.n_computed + self.n_failed, n_chunks)
+        finally:
+            pool.shutdown()
+
+        return results
+
+    # results of every chunk finished so far, in case order
+    def load(self):
+
+        chunks = []
+        i = 0
+        while os.path.exists(self.chunk_path(i)):
+            with np.load(self.chunk_path(i)) as f:
+                chunks.append(f['cases'])
+            i = i + 1
+        if not chunks:
+            return np.zeros(0, dtype=RampRoll.BATCH_DTYPE)
+        return np.concatenate(chunks)
@@ -4,11 +4,80 @@
 import tkinter as tk
 import tkinter.font as tkfont
 import tkinter.messagebox as tkmsg
+import tkinter.filedialog as tkfile
+import threading
+import queue
+import collections
 
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import (FigureCanvasTkAgg, NavigationToolbar2Tk)
 import numpy as np
 import RampRoll as RampRoll
+import ResultCache as ResultCache
+import InverseSolver as InverseSolver
+import MonteCarlo as MonteCarlo
+import Profiler as Profiler
+import TrajectoryArchive as TrajectoryArchive
+
+
+# Reduce (x, y) to at most 2*n_bins + 2 points, keeping the min and the max of y in each bin and the two
+# end points in x order, so the drawn curve looks the same at pixel resolution. x must be sorted.
+def minmax_decimate(x, y, n_bins: int):
+
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(x)
+    if n <= 2*n_bins or n_bins < 1:
+        return x, y
+
+    # n_bins - 1 equal blocks, the last bin also takes the n % n_bins left over samples
+    size = n//n_bins
+    m = size*(n_bins - 1)
+    blocks = y[:m].reshape(n_bins - 1, size)
+    offset = np.arange(n_bins - 1)*size
+    i_min = np.append(offset + blocks.argmin(axis=1), m + y[m:].argmin())
+    i_max = np.append(offset + blocks.argmax(axis=1), m + y[m:].argmax())
+    index = np.sort(np.concatenate((i_min, i_max, [0, n - 1])))
+    index = index[np.concatenate(([True], np.diff(index) > 0))]
+    return x[index], y[index]
+
+
+# expand (lo, hi) outwards to multiples of a round step, so similar runs keep the same axis limits
+def nice_limits(lo: float, hi: float):
+
+    if not np.isfinite(lo) or not np.isfinite(hi):
+        return -1., 1.
+    if hi <= lo:
+        return lo - 1., hi + 1.
+    step = 10.**np.floor(np.log10(hi - lo))/2.
+    return float(np.floor(lo/step)*step), float(np.ceil(hi/step)*step)
+
+
+# comparison mode keeps at most this many runs, each decimated to about COMPARE_POINTS float32 samples
+COMPARE_MAX_RUNS = 8
+COMPARE_POINTS = 2000
+
+
+# one run kept for the comparison overlay
+class StoredRun:
+    __slots__ = ('label', 'params', 'ta', 'va', 'sa', 'distance', 't_stop', 'lines')
+
+    def __init__(self, label: str, params: dict, ta, va, sa):
+
+        self.label = label
+        self.params = params
+        self.distance = float(sa[-1])
+        self.t_stop = float(ta[-1])
+        # min/max decimation of each curve on its own, then a common time base for both
+        t_v, v = minmax_decimate(ta, va, COMPARE_POINTS//2)
+        t_s, s = minmax_decimate(ta, sa, COMPARE_POINTS//2)
+        self.ta = np.union1d(t_v, t_s).astype(np.float32)
+        self.va = np.interp(self.ta, ta, va).astype(np.float32)
+        self.sa = np.interp(self.ta, ta, sa).astype(np.float32)
+        self.lines = []
+
+    def nbytes(self) -> int:
+        return self.ta.nbytes + self.va.nbytes + self.sa.nbytes
 
 
 class Plots:
@@ -18,14 +87,32 @@ class Plots:
     def __init__(self):
 
         self.canvas = None
+        # pixel buffer of the figure without the trajectory lines, for blitting
+        self.background = None
+        # full (ta, va, sa) of the last run, re-decimated when the view changes
+        self.data = None
+        # or (TrajectoryArchive, run number) of a stored run, of which only the visible window is loaded
+        self.archive_run = None
+        self.limits = None
+        # comparison overlay, least recently used run first
+        self.compare_runs = collections.OrderedDict()
+        self.n_compared = 0
+        # optional Profiler.RunProfiler, times canvas.draw / blit when set
+        self.profiler = None
         self.fig = plt.figure(figsize=(8, 7))
 
         self.ax1 = plt.subplot2grid((2, 1), (0, 0))
         self.ax1.set_xlabel('Time (sec)')
         self.ax1.set_ylabel('Velocity (m/s)')
+        self.ax1.grid()
         self.ax2 = plt.subplot2grid((2, 1), (1, 0))
         self.ax2.set_xlabel('Time (sec)')
         self.ax2.set_ylabel('Travel distance (m)')
+        self.ax2.grid()
+
+        # persistent artists, only their data changes between runs
+        self.v_line, = self.ax1.plot([], [], 'r', animated=True)
+        self.s_line, = self.ax2.plot([], [], 'b', animated=True)
 
         Plots.__instance__ = self
 
@@ -35,6 +122,9 @@ class Plots:
         self.canvas = FigureCanvasTkAgg(self.fig, master=root_tk)  # A tk.DrawingArea.
         self.canvas.get_tk_widget().grid(row=1, column=0, rowspan=15, columnspan=11, sticky='NSWE')
         # self.fig.tight_layout(w_pad=0.8, h_pad=0.0)
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+        self.ax1.callbacks.connect('xlim_changed', self.on_xlim_changed)
+        self.ax2.callbacks.connect('xlim_changed', self.on_xlim_changed)
 
         # ##############    TOOLBAR    ###############
         toolbar_frame = tk.Frame(master=root_tk)
@@ -42,6 +132,144 @@ class Plots:
         toolbar = NavigationToolbar2Tk(self.canvas, toolbar_frame)
         toolbar.update()
 
+    # every full draw (resize, zoom, pan, new limits) refreshes the background and puts the lines back on
+    def on_draw(self, event):
+
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.draw_lines()
+
+    def draw_lines(self):
+
+        self.ax1.draw_artist(self.v_line)
+        self.ax2.draw_artist(self.s_line)
+
+    # zoom / pan through the toolbar: decimate the visible part of the full trajectory again
+    def on_xlim_changed(self, ax):
+
+        if self.data is not None or self.archive_run is not None:
+            self.set_line_data()
+
+    def set_line_data(self):
+
+        if self.archive_run is not None:
+            archive, i = self.archive_run
+            for ax, line, k in ((self.ax1, self.v_line, 0), (self.ax2, self.s_line, 1)):
+                t_lo, t_hi = ax.get_xlim()
+                n_pixels = max(int(ax.bbox.width), 1)
+                t, y = archive.window(i, t_lo, t_hi, n_pixels)[k]
+                line.set_data(*minmax_decimate(t, y, n_pixels))
+            return
+
+        ta, va, sa = self.data
+        for ax, line, y in ((self.ax1, self.v_line, va), (self.ax2, self.s_line, sa)):
+            t_lo, t_hi = ax.get_xlim()
+            i_lo = max(int(np.searchsorted(ta, t_lo, side='left')) - 1, 0)
+            i_hi = int(np.searchsorted(ta, t_hi, side='right')) + 1
+            n_pixels = max(int(ax.bbox.width), 1)
+            line.set_data(*minmax_decimate(ta[i_lo:i_hi], y[i_lo:i_hi], n_pixels))
+
+    # Show a new trajectory. Only the line data changes; when the axis limits stay the same the
+    # lines are blitted onto the saved background instead of redrawing the whole figure.
+    def update_trajectory(self, ta, va, sa):
+
+        ta = np.asarray(ta, dtype=float)
+        va = np.asarray(va, dtype=float)
+        sa = np.asarray(sa, dtype=float)
+        self.data = (ta, va, sa)
+        self.archive_run = None
+        self.show_extent(ta[0], ta[-1], va.min(), va.max(), sa.min(), sa.max())
+
+    # Show run i of a TrajectoryArchive. The axis limits come from the stored min / max summary and
+    # zoom / pan only read the visible window of the run, at screen resolution.
+    def show_archived_run(self, archive, i: int):
+
+        self.data = None
+        self.archive_run = (archive, i)
+        self.show_extent(*archive.extent(i))
+
+    def show_extent(self, t_lo, t_hi, v_lo, v_hi, s_lo, s_hi):
+
+        v_lo = min(v_lo, 0.)
+        for run in self.compare_runs.values():
+            t_hi = max(t_hi, run.ta[-1])
+            v_hi = max(v_hi, run.va.max())
+            s_lo = min(s_lo, run.sa.min())
+            s_hi = max(s_hi, run.sa.max())
+        limits = (nice_limits(t_lo, t_hi), nice_limits(v_lo, v_hi), nice_limits(s_lo, s_hi))
+
+        prof = self.profiler
+        if prof is not None:
+            t_prof = prof.start()
+        if limits != self.limits or self.background is None:
+            self.limits = limits
+            self.ax1.set_xlim(*limits[0])
+            self.ax2.set_xlim(*limits[0])
+            self.ax1.set_ylim(*limits[1])
+            self.ax2.set_ylim(*limits[2])
+            self.set_line_data()
+            self.canvas.draw()
+            phase = 'draw'
+        else:
+            self.set_line_data()
+            self.blit()
+            phase = 'blit'
+        self.canvas.flush_events()
+        if prof is not None:
+            prof.stop(phase, t_prof)
+
+    # Keep a run in the comparison overlay. Runs with the same parameters replace each other, the least
+    # recently used run is dropped beyond COMPARE_MAX_RUNS. Returns the stored runs, oldest first.
+    def add_comparison(self, params: dict, ta, va, sa):
+
+        key = tuple(sorted((name, round(float(x), 9)) for name, x in params.items()))
+        if key in self.compare_runs:
+            self.compare_runs.move_to_end(key)
+            return list(self.compare_runs.values())
+
+        label = 'angle %.1f, m %.2f, ur %.3f, uf %.3f, c %.4f' % (
+            params['theta'], params['m'], params['u_r'], params['u_f'], params['c'])
+        run = StoredRun(label, params, np.asarray(ta, dtype=float), np.asarray(va, dtype=float),
+                        np.asarray(sa, dtype=float))
+        # 10 colors for at most COMPARE_MAX_RUNS runs, consecutive runs never share one
+        color = 'C%d' % (self.n_compared % 10)
+        self.n_compared = self.n_compared + 1
+        run.lines = [self.ax1.plot(run.ta, run.va, color=color, lw=1, alpha=0.7, label=label)[0],
+                     self.ax2.plot(run.ta, run.sa, color=color, lw=1, alpha=0.7)[0]]
+        self.compare_runs[key] = run
+        while len(self.compare_runs) > COMPARE_MAX_RUNS:
+            key_old, old = self.compare_runs.popitem(last=False)
+            for line in old.lines:
+                line.remove()
+
+        self.ax1.legend(loc='upper right', fontsize='x-small')
+        # the overlay is part of the background, force a full draw next time
+        self.background = None
+        return list(self.compare_runs.values())
+
+    def clear_comparison(self):
+
+        for run in self.compare_runs.values():
+            for line in run.lines:
+                line.remove()
+        self.compare_runs.clear()
+        legend = self.ax1.get_legend()
+        if legend is not None:
+            legend.remove()
+        self.background = None
+        self.limits = None
+        if self.data is not None:
+            self.update_trajectory(*self.data)
+        elif self.archive_run is not None:
+            self.show_archived_run(*self.archive_run)
+        else:
+            self.canvas.draw()
+
+    def blit(self):
+
+        self.canvas.restore_region(self.background)
+        self.draw_lines()
+        self.canvas.blit(self.fig.bbox)
+
     def __del__(self):
         Plots.__instance__ = None
 
@@ -54,6 +282,85 @@ class Plots:
         return Plots.__instance__
 
 
+# live mode: wait this long after the last slider move before starting a run, and poll results this often
+LIVE_DEBOUNCE_MS = 30
+LIVE_POLL_MS = 16
+LIVE_SAMPLES = 2000
+
+
+# Simulation for live mode, runs on the worker thread.
+# Uses the analytic solver sampled at LIVE_SAMPLES times, so one run takes well under a frame.
+def live_simulate(params: dict):
+
+    rr = RampRoll.RampRoll()
+    for name, value in params.items():
+        if name != 'slope_length':
+            setattr(rr, name, value)
+    summary = rr.solve(params['slope_length'])
+    t_end = max(summary['t_stop'], 1e-6)
+    result = rr.solve(params['slope_length'], t_out=np.linspace(0., t_end, LIVE_SAMPLES))
+    return result
+
+
+# Runs the most recent request on one worker thread. A request that is superseded before the worker
+# picks it up is dropped, results are handed back through a queue that the Tk main loop polls.
+class LiveSimulation:
+
+    def __init__(self, func):
+
+        self.func = func
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.request = None
+        self.generation = 0
+        self.results = queue.Queue()
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def submit(self, *args) -> int:
+
+        with self.lock:
+            self.generation = self.generation + 1
+            self.request = (self.generation, args)
+        self.wakeup.set()
+        return self.generation
+
+    def work(self):
+
+        while True:
+            self.wakeup.wait()
+            with self.lock:
+                request = self.request
+                self.request = None
+                self.wakeup.clear()
+            if request is None:
+                continue
+            generation, args = request
+            try:
+                result = self.func(*args)
+            except Exception as e:
+                result = e
+            self.results.put((generation, result))
+
+    # result of the latest request if it has arrived, None otherwise; stale results are thrown away
+    def latest(self):
+
+        latest = None
+        while True:
+            try:
+                generation, result = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if generation == self.generation:
+                latest = (generation, result)
+        return latest
+
+
+# tornado chart labels of the RampRoll.BATCH_INPUTS
+SENSITIVITY_LABELS = {'m': 'Car Mass', 'theta': 'Angle', 'u_r': 'Ramp Friction', 'u_f': 'Floor Friction',
+                      'c': 'Air Drag', 'slope_length': 'Ramp Length'}
+
+
 class GuiWindow:
     __instance__ = None
 
@@ -67,12 +374,16 @@ class GuiWindow:
         self.frame01.grid(row=0, column=1, sticky=tk.N, padx=10, pady=40)
         self.frame02 = tk.Frame(self.window)
         self.frame02.grid(row=1, column=1, sticky=tk.N, padx=10, pady=0)
+        self.frame03 = tk.Frame(self.window)
+        self.frame03.grid(row=2, column=1, sticky=tk.N, padx=10, pady=10)
 
         self.label_font_16 = tkfont.Font(family="Helvetica", size=16, weight="bold")
         self.label_font_12 = tkfont.Font(family="Helvetica", size=12, weight="bold")
         self.report_font_12 = tkfont.Font(family="Helvetica", size=12)
 
         self.rr_obj = RampRoll.RampRoll()
+        self.result_cache = ResultCache.ResultCache()
+        self.inverse_solver = InverseSolver.InverseSolver(self.rr_obj)
         self.angle_height_opt_list = ['height', 'angle', 'width']
         self.length_unit_opt_list = ['m', 'cm', 'Inches']
         self.unit_factor: float = 1.
@@ -94,6 +405,29 @@ class GuiWindow:
         self.angle_unit_var = tk.StringVar(self.window, value=self.length_unit_opt_list[0])
         self.angle_report_var = tk.StringVar(self.window, value='')
         self.distant_report_var = tk.StringVar(self.window, value='0.0')
+        self.target_dist_var = tk.DoubleVar(self.window, value=10.0)
+        self.compare_mode_var = tk.BooleanVar(self.window, value=False)
+        self.live_mode_var = tk.BooleanVar(self.window, value=False)
+        self.live_angle_var = tk.DoubleVar(self.window, value=30.0)
+        # the sliders have their own variables, Scale would clamp and round values typed into the entries
+        self.live_mass_var = tk.DoubleVar(self.window, value=1.0)
+        self.live_ramp_friction_var = tk.DoubleVar(self.window, value=0.1)
+        self.live_floor_friction_var = tk.DoubleVar(self.window, value=0.1)
+        self.live_air_drag_var = tk.DoubleVar(self.window, value=0.002)
+        self.mc_spread_var = tk.DoubleVar(self.window, value=2.0)
+        self.mc_samples_var = tk.IntVar(self.window, value=100000)
+        self.mc_seed = 0
+        self.figure_windows = {}
+        self.profile_mode_var = tk.BooleanVar(self.window, value=False)
+        self.profile_report_var = tk.StringVar(self.window, value='')
+        self.profiler = Profiler.RunProfiler()
+        self.archive = None
+        self.archive_mode_var = tk.BooleanVar(self.window, value=False)
+        self.archive_run_var = tk.IntVar(self.window, value=0)
+        self.archive_report_var = tk.StringVar(self.window, value='No archive')
+        self.live_sim = None
+        self.live_after_id = None
+        self.live_poll_id = None
 
         ramp_friction_coeff = self.ramp_friction_coeff_var.get()
         floor_friction_coeff = self.floor_friction_coeff_var.get()
@@ -153,6 +487,16 @@ class GuiWindow:
                                       font=self.label_font_12)
         dist_result_report.grid(row=6, column=1, pady=0, sticky=tk.EW)
 
+        # inverse mode: find the ramp height / angle / width for a target distance
+        target_label = tk.Label(self.frame01, text='Target (m)', width=15)
+        target_label.grid(row=7, column=0, pady=(10, 0))
+        target_entry = tk.Entry(self.frame01, textvariable=self.target_dist_var,
+                                width=10, justify='right')
+        target_entry.grid(row=7, column=1, pady=(10, 0))
+        solve_btn = tk.Button(self.frame01, text='Solve for target', command=self.solve_for_target,
+                              font=self.label_font_12)
+        solve_btn.grid(row=8, column=0, columnspan=2, sticky=tk.EW)
+
         # angle calculator
         '''
         cal_label = tk.Label(self.frame01, text='Slope Angle Calculator', font=self.label_font_12)
@@ -218,6 +562,70 @@ class GuiWindow:
         load_default_btn = tk.Button(self.frame02, text='Load default values', command=self.load_default_parameters,
                                      width=15, font=self.label_font_12)
         load_default_btn.grid(row=6, column=0, columnspan=2, sticky=tk.EW)
+        mc_spread_label = tk.Label(self.frame02, text='Uncertainty (%)', width=15)
+        mc_spread_label.grid(row=7, column=0, pady=(10, 0))
+        mc_spread_entry = tk.Entry(self.frame02, textvariable=self.mc_spread_var,
+                                   width=10, justify='right')
+        mc_spread_entry.grid(row=7, column=1, padx=1, pady=(10, 0))
+        mc_samples_label = tk.Label(self.frame02, text='Max samples', width=15)
+        mc_samples_label.grid(row=8, column=0)
+        mc_samples_entry = tk.Entry(self.frame02, textvariable=self.mc_samples_var,
+                                    width=10, justify='right')
+        mc_samples_entry.grid(row=8, column=1, padx=1)
+        mc_btn = tk.Button(self.frame02, text='Monte Carlo', command=self.run_monte_carlo,
+                           width=15, font=self.label_font_12)
+        mc_btn.grid(row=9, column=0, columnspan=2, sticky=tk.EW)
+        sens_btn = tk.Button(self.frame02, text='Sensitivity', command=self.show_sensitivity,
+                             width=15, font=self.label_font_12)
+        sens_btn.grid(row=10, column=0, columnspan=2, sticky=tk.EW)
+
+        # live mode sliders, every move re-runs the simulation in the background
+        live_check = tk.Checkbutton(self.frame03, text='Live mode', variable=self.live_mode_var,
+                                    command=self.on_live_change, font=self.label_font_12)
+        live_check.grid(row=0, column=0, columnspan=2)
+        live_sliders = [('Angle (degree)', self.live_angle_var, 0.5, 89.5, 0.5),
+                        ('Car Mass (kg)', self.live_mass_var, 0.01, 5.0, 0.01),
+                        ('Ramp Friction', self.live_ramp_friction_var, 0.0, 1.0, 0.005),
+                        ('Floor Friction', self.live_floor_friction_var, 0.0, 1.0, 0.005),
+                        ('Air Drag', self.live_air_drag_var, 0.0, 0.05, 0.0005)]
+        for i, (text, var, lo, hi, res) in enumerate(live_sliders):
+            slider_label = tk.Label(self.frame03, text=text, width=15)
+            slider_label.grid(row=i + 1, column=0, sticky=tk.S)
+            slider = tk.Scale(self.frame03, variable=var, from_=lo, to=hi, resolution=res,
+                              orient=tk.HORIZONTAL, length=160,
+                              command=lambda value: self.on_live_change())
+            slider.grid(row=i + 1, column=1)
+
+        # comparison of the last runs: overlay in the plots and a table with the deltas to the latest run
+        compare_check = tk.Checkbutton(self.frame03, text='Compare runs', variable=self.compare_mode_var,
+                                       font=self.label_font_12)
+        compare_check.grid(row=len(live_sliders) + 1, column=0, pady=(10, 0))
+        compare_clear_btn = tk.Button(self.frame03, text='Clear runs', command=self.clear_comparison)
+        compare_clear_btn.grid(row=len(live_sliders) + 1, column=1, pady=(10, 0))
+        self.compare_table = tk.Text(self.frame03, width=60, height=COMPARE_MAX_RUNS + 1,
+                                     font=('Courier', 9), state=tk.DISABLED)
+        self.compare_table.grid(row=len(live_sliders) + 2, column=0, columnspan=2)
+
+        # trajectory archive: store every run, browse stored runs (only the visible part is loaded)
+        archive_check = tk.Checkbutton(self.frame03, text='Save runs', variable=self.archive_mode_var,
+                                       font=self.label_font_12)
+        archive_check.grid(row=len(live_sliders) + 3, column=0, pady=(10, 0))
+        archive_open_btn = tk.Button(self.frame03, text='Open archive', command=self.open_archive)
+        archive_open_btn.grid(row=len(live_sliders) + 3, column=1, pady=(10, 0))
+        archive_run_entry = tk.Entry(self.frame03, textvariable=self.archive_run_var, width=10, justify='right')
+        archive_run_entry.grid(row=len(live_sliders) + 4, column=0)
+        archive_show_btn = tk.Button(self.frame03, text='Show stored run', command=self.show_archived_run)
+        archive_show_btn.grid(row=len(live_sliders) + 4, column=1)
+        archive_report = tk.Label(self.frame03, textvariable=self.archive_report_var)
+        archive_report.grid(row=len(live_sliders) + 5, column=0, columnspan=2)
+
+        # timing breakdown of the last run, see Profiler.py
+        profile_check = tk.Checkbutton(self.window, text='Profile runs', variable=self.profile_mode_var,
+                                       command=self.set_profile_mode)
+        profile_check.grid(row=3, column=1, sticky=tk.W, padx=10)
+        profile_report = tk.Label(self.window, textvariable=self.profile_report_var, anchor=tk.W,
+                                  font=('Courier', 9))
+        profile_report.grid(row=3, column=0, sticky=tk.EW, padx=10)
 
         self.window.update_idletasks()
 
@@ -246,9 +654,9 @@ class GuiWindow:
         else:
             self.angle_unit_var.set(unit_opt)
 
-    def run_ramp_roll(self):
+    # ramp angle (degree) from the height / angle / width entry, None (after a message box) for bad input
+    def get_ramp_angle(self):
 
-        m_car = self.car_mass_var.get()
         length_ramp = self.ramp_length_var.get()
         angle_height = self.ramp_angle_var.get()
         angle_height_opt = self.angle_opt_var.get()
@@ -260,7 +668,7 @@ class GuiWindow:
                 tkmsg.showinfo('Error Input',
                                ' Slope length must be larger than ramp height and greater than zero !'
                                )
-                return
+                return None
             theta_rad = np.arcsin(angle_height/length_ramp)
             theta_ramp = theta_rad*180/np.pi
         if angle_height_opt == 'width':
@@ -268,32 +676,280 @@ class GuiWindow:
                 tkmsg.showinfo('Error Input',
                                ' Slope bottom width must be greater than zero !'
                                )
-                return
+                return None
             theta_rad = np.arccos(angle_height/length_ramp)
             theta_ramp = theta_rad*180/np.pi
 
         self.angle_report_var.set('%.3f' % theta_ramp)
+        return theta_ramp
+
+    def run_ramp_roll(self):
+
+        m_car = self.car_mass_var.get()
+        length_ramp = self.ramp_length_var.get()
+        theta_ramp = self.get_ramp_angle()
+        if theta_ramp is None:
+            return
 
         self.rr_obj.set_car_mass(m_car)
         self.rr_obj.set_ramp_angle(theta_ramp)
-        va, sa, ta = self.rr_obj.run(length_ramp*self.unit_factor)
+        prof = self.rr_obj.profiler
+        if prof is not None:
+            prof.reset()
+            t_prof = prof.start()
+        try:
+            va, sa, ta = self.result_cache.run(self.rr_obj, length_ramp*self.unit_factor)
+        except RampRoll.NoSlideError as e:
+            tkmsg.showinfo('Error', str(e))
+            return
+        if prof is not None:
+            prof.stop('simulate', t_prof, steps=len(ta))
         final_dist = '%.3f' % sa[-1]
 
         self.distant_report_var.set(final_dist)
 
-        self.plot.ax1.cla()
-        self.plot.ax2.cla()
-        self.plot.ax1.grid()
-        self.plot.ax2.grid()
-        self.plot.ax1.plot(ta, va, 'r')
-        self.plot.ax2.plot(ta, sa, 'b')
-        self.plot.ax1.set_ylabel('Velocity (m/s)')
-        self.plot.ax1.set_xlabel('Time (sec)')
-        self.plot.ax2.set_ylabel('Travel distance (m)')
-        self.plot.ax2.set_xlabel('Time (sec)')
-
-        self.plot.canvas.draw()
-        self.plot.canvas.flush_events()
+        params = {'m': m_car, 'theta': theta_ramp, 'u_r': self.rr_obj.u_r, 'u_f': self.rr_obj.u_f,
+                  'c': self.rr_obj.c, 'slope_length': length_ramp*self.unit_factor}
+        if self.archive_mode_var.get() and (self.archive is not None or self.open_archive()):
+            status = RampRoll.STATUS_FLOOR_LIMIT if va[-1] > 0. else RampRoll.STATUS_STOPPED
+            i = self.archive.append(ta, va, sa, params, status)
+            self.archive_run_var.set(i)
+            self.archive_report_var.set('Saved run %d of %d' % (i, len(self.archive)))
+        if self.compare_mode_var.get():
+            runs = self.plot.add_comparison(params, ta, va, sa)
+            self.update_compare_table(runs)
+        self.plot.update_trajectory(ta, va, sa)
+        if prof is not None:
+            self.profile_report_var.set(prof.breakdown())
+
+    # open (or create) an archive directory for appending, returns False when the dialog was cancelled
+    def open_archive(self) -> bool:
+
+        path = tkfile.askdirectory(parent=self.window, title='Trajectory archive directory')
+        if not path:
+            return False
+        try:
+            archive = TrajectoryArchive.TrajectoryArchive(path, 'a')
+        except (OSError, ValueError, KeyError) as e:
+            tkmsg.showinfo('Error', ' Cannot open trajectory archive %s : %s' % (path, e))
+            return False
+        if self.archive is not None:
+            self.archive.close()
+        self.archive = archive
+        self.archive_report_var.set('%d runs in %s' % (len(archive), path))
+        return True
+
+    def show_archived_run(self):
+
+        if self.archive is None and not self.open_archive():
+            return
+        i = self.archive_run_var.get()
+        if not 0 <= i < len(self.archive) or self.archive.index['n'][i] == 0:
+            tkmsg.showinfo('Error Input', ' No stored run %d ! The archive has %d runs.' % (i, len(self.archive)))
+            return
+        record = self.archive.index[i]
+        self.distant_report_var.set('%.3f' % record['distance'])
+        self.archive_report_var.set('Run %d: angle %.1f, m %.2f, %d samples' % (
+            i, record['theta'], record['m'], record['n']))
+        self.plot.show_archived_run(self.archive, i)
+
+    # the profiler stays attached to the engine and the plots only while profiling is switched on
+    def set_profile_mode(self):
+
+        if self.profile_mode_var.get():
+            self.rr_obj.profiler = self.profiler
+            self.plot.profiler = self.profiler
+        else:
+            self.rr_obj.profiler = None
+            self.plot.profiler = None
+            self.profile_report_var.set('')
+
+    # parameter table of the compared runs, newest last, with distance / stop time deltas to the newest run
+    def update_compare_table(self, runs):
+
+        lines = ['%5s %6s %5s %5s %6s %7s %8s %8s' % ('angle', 'm', 'ur', 'uf', 'c', 'dist', 'd_dist', 'd_time')]
+        if runs:
+            latest = runs[-1]
+            for run in runs:
+                p = run.params
+                lines.append('%5.1f %6.3f %5.3f %5.3f %6.4f %7.3f %+8.3f %+8.3f' % (
+                    p['theta'], p['m'], p['u_r'], p['u_f'], p['c'], run.distance,
+                    run.distance - latest.distance, run.t_stop - latest.t_stop))
+        self.compare_table.configure(state=tk.NORMAL)
+        self.compare_table.delete('1.0', tk.END)
+        self.compare_table.insert(tk.END, '\n'.join(lines))
+        self.compare_table.configure(state=tk.DISABLED)
+
+    def clear_comparison(self):
+
+        self.plot.clear_comparison()
+        self.update_compare_table([])
+
+    # Solve for the height / angle / width picked in the option menu so the car stops at the target distance,
+    # then run it to show the trajectory
+    def solve_for_target(self):
+
+        target = self.target_dist_var.get()
+        length_ramp = self.ramp_length_var.get()
+        angle_height_opt = self.angle_opt_var.get()
+        self.change_to_meter()
+        if length_ramp <= 0.0:
+            tkmsg.showinfo('Error Input', ' Slope length must be greater than zero !')
+            return
+
+        param = 'theta' if angle_height_opt == 'angle' else angle_height_opt
+        self.rr_obj.set_car_mass(self.car_mass_var.get())
+        x, converged = self.inverse_solver.solve(target, param, slope_length=length_ramp*self.unit_factor)
+        if not converged:
+            tkmsg.showinfo('Error Input',
+                           ' Target distance cannot be reached by changing the ramp %s !' % angle_height_opt)
+            return
+        if param != 'theta':
+            x = x/self.unit_factor
+
+        self.ramp_angle_var.set(round(x, 6))
+        self.run_ramp_roll()
+
+    # slider moved (or live mode switched on): debounce, then start a background run
+    def on_live_change(self):
+
+        if not self.live_mode_var.get():
+            return
+        if self.live_after_id is not None:
+            self.window.after_cancel(self.live_after_id)
+        self.live_after_id = self.window.after(LIVE_DEBOUNCE_MS, self.start_live_run)
+
+    def start_live_run(self):
+
+        self.live_after_id = None
+        if self.live_sim is None:
+            self.live_sim = LiveSimulation(live_simulate)
+        self.change_to_meter()
+        params = {'m': self.live_mass_var.get(), 'theta': self.live_angle_var.get(),
+                  'u_r': self.live_ramp_friction_var.get(), 'u_f': self.live_floor_friction_var.get(),
+                  'c': self.live_air_drag_var.get(), 'floor_limit': self.rr_obj.floor_limit,
+                  'slope_length': self.ramp_length_var.get()*self.unit_factor}
+        if params['m'] <= 0.:
+            return
+        # keep the entries and the Run button in step with the sliders
+        self.car_mass_var.set(params['m'])
+        self.ramp_friction_coeff_var.set(params['u_r'])
+        self.floor_friction_coeff_var.set(params['u_f'])
+        self.air_drag_coeff_var.set(params['c'])
+        self.rr_obj.set_car_mass(params['m'])
+        self.rr_obj.set_ramp_friction_coeff(params['u_r'])
+        self.rr_obj.set_floor_friction_coeff(params['u_f'])
+        self.rr_obj.set_air_drag_coeff(params['c'])
+        self.live_sim.submit(params)
+        if self.live_poll_id is None:
+            self.live_poll_id = self.window.after(LIVE_POLL_MS, self.poll_live)
+
+    # runs on the Tk main loop, picks up the result of the latest live run
+    def poll_live(self):
+
+        self.live_poll_id = None
+        latest = self.live_sim.latest()
+        if latest is None:
+            self.live_poll_id = self.window.after(LIVE_POLL_MS, self.poll_live)
+            return
+
+        generation, result = latest
+        if isinstance(result, Exception):
+            self.distant_report_var.set('Error')
+            return
+        self.angle_report_var.set('%.3f' % self.live_angle_var.get())
+        if result['status'] == RampRoll.STATUS_NO_SLIDE:
+            self.distant_report_var.set('No slide')
+            return
+        self.distant_report_var.set('%.3f' % result['distance'])
+        self.plot.update_trajectory(result['ta'], result['va'], result['sa'])
+
+    # Monte Carlo run around the current inputs: every input is normal with a relative std of the
+    # uncertainty entry, the distance distribution is shown as a histogram in its own window
+    def run_monte_carlo(self):
+
+        theta_ramp = self.get_ramp_angle()
+        if theta_ramp is None:
+            return
+        spread = self.mc_spread_var.get()/100.
+        if self.mc_samples_var.get() < 1:
+            tkmsg.showinfo('Error Input', ' Number of samples must be at least 1 !')
+            return
+        self.rr_obj.set_car_mass(self.car_mass_var.get())
+        self.rr_obj.set_ramp_angle(theta_ramp)
+        nominal = {'m': self.rr_obj.m, 'theta': theta_ramp, 'u_r': self.rr_obj.u_r, 'u_f': self.rr_obj.u_f,
+                   'c': self.rr_obj.c, 'slope_length': self.ramp_length_var.get()*self.unit_factor}
+        distributions = {name: MonteCarlo.Normal(value, abs(value)*spread, lo=0.)
+                         for name, value in nominal.items()}
+        distributions['m'].lo = 1e-6
+        mc = MonteCarlo.MonteCarlo(self.rr_obj, distributions, seed=self.mc_seed)
+        self.mc_seed = self.mc_seed + 1
+        result = mc.run(max_samples=self.mc_samples_var.get())
+        self.show_monte_carlo(result)
+
+    # axes and canvas of a separate plot window, created on first use and reused while it stays open
+    def figure_window(self, name: str, title: str):
+
+        window = self.figure_windows.get(name)
+        if window is None or not window[0].winfo_exists():
+            top = tk.Toplevel(self.window)
+            top.title(title)
+            fig = plt.Figure(figsize=(6, 4))
+            ax = fig.add_subplot(1, 1, 1)
+            canvas = FigureCanvasTkAgg(fig, master=top)
+            canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+            window = self.figure_windows[name] = (top, ax, canvas)
+        window[1].clear()
+        return window[1], window[2]
+
+    def show_monte_carlo(self, result: dict):
+
+        ax, canvas = self.figure_window('monte_carlo', 'Monte Carlo distance distribution')
+        counts, edges = result['histogram']
+        pct = result['percentiles']
+        ax.stairs(counts, edges, fill=True, color='tab:blue', alpha=0.6)
+        for q in (5, 50, 95):
+            ax.axvline(pct[q], color='k', linestyle='--' if q != 50 else '-', linewidth=1)
+        ax.set_xlabel('Travel distance (m)')
+        ax.set_ylabel('Samples')
+        title = 'n=%d  mean=%.3f +- %.3f m  5%%/50%%/95%%: %.3f / %.3f / %.3f' % (
+            result['n_valid'], result['mean'], result['ci_half_width'], pct[5], pct[50], pct[95])
+        if result['n_valid'] < result['n']:
+            # samples that never reached the floor are not in the distribution
+            excluded = ['%s: %d' % (name, count) for name, count in result['status_counts'].items()
+                        if name not in ('stopped', 'floor_limit')]
+            title = title + '\n' + ', '.join(excluded)
+        ax.set_title(title, fontsize=9)
+        ax.grid()
+        canvas.draw()
+
+    # Tornado chart of the distance change when each input moves by +- the uncertainty entry (in %),
+    # linearized with the analytic sensitivities, largest effect on top
+    def show_sensitivity(self):
+
+        theta_ramp = self.get_ramp_angle()
+        if theta_ramp is None:
+            return
+        spread = self.mc_spread_var.get()/100.
+        self.rr_obj.set_car_mass(self.car_mass_var.get())
+        self.rr_obj.set_ramp_angle(theta_ramp)
+        cases = RampRoll.batch_cases(self.rr_obj.m, theta_ramp, self.rr_obj.u_r, self.rr_obj.u_f, self.rr_obj.c,
+                                     self.ramp_length_var.get()*self.unit_factor)
+        sens = self.rr_obj.sensitivity_batch(cases)
+        effects = sorted(((abs(sens[name][0]*cases[name][0])*spread, name) for name in RampRoll.BATCH_INPUTS))
+
+        ax, canvas = self.figure_window('sensitivity', 'Distance sensitivity')
+        names = [SENSITIVITY_LABELS[name] for effect, name in effects]
+        signs = np.sign([sens[name][0] for effect, name in effects])
+        widths = np.array([effect for effect, name in effects])
+        ax.barh(names, signs*widths, color='tab:red', alpha=0.7, label='+%g %%' % (100*spread))
+        ax.barh(names, -1.*signs*widths, color='tab:blue', alpha=0.7, label='-%g %%' % (100*spread))
+        ax.axvline(0., color='k', linewidth=1)
+        ax.set_xlabel('Distance change (m), distance %.3f m' % cases['distance'][0])
+        ax.legend(loc='lower right', fontsize='small')
+        ax.grid(axis='x')
+        canvas.figure.tight_layout()
+        canvas.draw()
 
     def set_ramp_friction_coeff(self):
 
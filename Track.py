@@ -0,0 +1,135 @@
+# Piecewise track engine for the Ramp and Roll simulator
+# A track is a list of straight segments, each with its own length, angle and friction. Positive angles slope
+# down in the direction of travel, negative angles are up-hill sections. The car is advanced from one event
+# (segment boundary, stop, reversal) to the next with the closed form phase_* solutions of RampRoll, so the
+# cost scales with the number of events and not with the simulated time.
+import numpy as np
+import RampRoll as RampRoll
+
+# events before Track.solve gives up with STATUS_MAX_STEPS, e.g. a car swinging in a frictionless valley
+TRACK_MAX_EVENTS = 10000
+# a car coming to rest closer than this (m) to a segment boundary is put on the boundary, so a car settling
+# in a V shaped valley stops there instead of swinging with ever smaller amplitude until TRACK_MAX_EVENTS
+TRACK_X_TOL = 1e-9
+
+
+class Segment:
+    __slots__ = ('length', 'theta', 'u')
+
+    # length in m, theta in degree (negative: up-hill), u friction coefficient
+    def __init__(self, length: float, theta: float, u: float):
+
+        if not length >= 0.:
+            raise ValueError('Segment length must not be negative !')
+        self.length = float(length)
+        self.theta = float(theta)
+        self.u = float(u)
+
+    def __repr__(self):
+        return 'Segment(%g, %g, %g)' % (self.length, self.theta, self.u)
+
+
+class Track:
+
+    # segments: Segment objects or (length, theta, u) tuples, in the order the car meets them
+    def __init__(self, segments):
+
+        self.segments = [x if isinstance(x, Segment) else Segment(*x) for x in segments]
+        if not self.segments:
+            raise ValueError('A track needs at least one segment !')
+
+        # per segment constants, the net slope accelerations are in units of g
+        theta_rad = np.array([x.theta for x in self.segments])*np.pi/180.
+        u = np.array([x.u for x in self.segments])
+        self.start = np.concatenate(([0.], np.cumsum([x.length for x in self.segments])))
+        self.sin = np.sin(theta_rad)
+        self.k_forward = self.sin - u*np.cos(theta_rad)
+        # moving backwards the slope changes sign, friction still opposes the motion
+        self.k_backward = -1.*self.sin - u*np.cos(theta_rad)
+        # static friction holds a car at rest when tan|theta| <= u
+        self.hold = np.abs(self.sin) <= u*np.cos(theta_rad)
+
+    # the single ramp + floor of RampRoll as a track, the floor ends at floor_limit
+    @classmethod
+    def from_ramp(cls, rr_obj, slope_length=5):
+        return cls([Segment(slope_length, rr_obj.theta, rr_obj.u_r), Segment(rr_obj.floor_limit, 0., rr_obj.u_f)])
+
+    @property
+    def length(self) -> float:
+        return float(self.start[-1])
+
+    # Run the car from rest at the start of the track (m, c, g come from rr_obj).
+    # Returns a dict like RampRoll.solve: status, t_stop, v_end (negative when rolling back), distance
+    # (position along the track), segment (index of the final segment), n_events, plus va / sa / ta sampled
+    # at the output times t_out when given.
+    def solve(self, rr_obj, t_out=None, max_events=TRACK_MAX_EVENTS):
+
+        g = rr_obj.g
+        gamma = rr_obj.c/rr_obj.m
+        n_seg = len(self.segments)
+        t = 0.
+        x = 0.
+        w = 0.
+        d = 1
+        i = 0
+        # one leg per stretch of motion without an event: start time, start position, direction, speed, k
+        legs = []
+        status = None
+        while status is None:
+            if len(legs) >= max_events:
+                status = RampRoll.STATUS_MAX_STEPS
+                break
+            if w <= 0.:
+                # at rest: stay if static friction holds the car, otherwise slide down the slope
+                if self.hold[i]:
+                    status = RampRoll.STATUS_STOPPED if legs else RampRoll.STATUS_NO_SLIDE
+                    break
+                d = 1 if self.sin[i] > 0. else -1
+                edge = self.start[i + 1] if d > 0 else self.start[i]
+                if abs(edge - x) <= TRACK_X_TOL:
+                    x = edge
+                    j = i + d
+                    # bottom of a valley between two segments sloping towards each other
+                    if 0 <= j < n_seg and (self.hold[j] or (self.sin[j] > 0.) != (d > 0)):
+                        status = RampRoll.STATUS_STOPPED if legs else RampRoll.STATUS_NO_SLIDE
+                        break
+
+            k = g*(self.k_forward[i] if d > 0 else self.k_backward[i])
+            gap = self.start[i + 1] - x if d > 0 else x - self.start[i]
+            legs.append((t, x, d, w, k))
+            t_stop, x_stop = RampRoll.phase_stop(w, k, gamma)
+            if x_stop < gap:
+                t = t + float(t_stop)
+                x = x + d*float(x_stop)
+                w = 0.
+                continue
+
+            t = t + float(RampRoll.phase_time_at(gap, w, k, gamma))
+            w = float(RampRoll.phase_speed_at(gap, w, k, gamma))
+            x = self.start[i + 1] if d > 0 else self.start[i]
+            i = i + d
+            if i == n_seg:
+                i = n_seg - 1
+                status = RampRoll.STATUS_FLOOR_LIMIT
+            elif i < 0:
+                i = 0
+                status = RampRoll.STATUS_ROLLED_BACK
+
+        result = {'status': status, 't_stop': t, 'v_end': d*w, 'distance': float(x), 'segment': i,
+                  'n_events': len(legs)}
+        if t_out is not None:
+            result.update(self._sample(legs, t, gamma, t_out))
+        return result
+
+    # trajectory at the output times, each time is evaluated on its own leg in one vectorized call
+    @staticmethod
+    def _sample(legs, t_end, gamma, t_out):
+
+        ta = np.asarray(t_out, dtype=float)
+        if not legs:
+            return {'va': np.zeros_like(ta), 'sa': np.zeros_like(ta), 'ta': ta}
+        t0, x0, d, w0, k = [np.array(x) for x in zip(*legs)]
+        tc = np.clip(ta, 0., t_end)
+        j = np.maximum(np.searchsorted(t0, tc, side='right') - 1, 0)
+        v, x = RampRoll.phase_state(tc - t0[j], w0[j], k[j], gamma)
+        return {'va': d[j]*v, 'sa': x0[j] + d[j]*x, 'ta': ta}
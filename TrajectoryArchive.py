@@ -0,0 +1,264 @@
+# Trajectory archive - append-only store of full (t, v, s) trajectories in memory-mapped column files
+# Layout of an archive directory:
+#   archive.json        format, sample dtype and pyramid shape
+#   t.bin v.bin s.bin   the samples of all runs back to back, one raw column file per quantity
+#   pyramid.bin         per run min/max summary at several resolutions (PYRAMID_DTYPE records)
+#   index.bin           one TRAJ_INDEX_DTYPE record per run: offsets into the files above, inputs and result
+# A run is only committed once its index record is written, so a crash leaves at most some unused bytes
+# at the end of the column files, which are cut off the next time the archive is opened for appending.
+# window() reads only the part of a run visible in a plot, at screen resolution, so millions of stored
+# runs can be browsed without loading them into memory.
+import os
+import json
+import numpy as np
+import RampRoll as RampRoll
+
+
+ARCHIVE_VERSION = 1
+COLUMNS = ('t', 'v', 's')
+# level 1 of the pyramid summarizes blocks of PYRAMID_BASE samples, every further level PYRAMID_FACTOR blocks
+# of the level below, up to a single block covering the whole run
+PYRAMID_BASE = 64
+PYRAMID_FACTOR = 8
+TRAJ_INDEX_DTYPE = np.dtype([('offset', 'i8'), ('n', 'i8'), ('pyramid_offset', 'i8'), ('n_pyramid', 'i8')] +
+                            [(name, 'f8') for name in RampRoll.BATCH_INPUTS] +
+                            [('distance', 'f8'), ('status', 'i1')])
+# per block the minimum and the maximum of v and s together with their times
+PYRAMID_DTYPE = np.dtype([('tv_min', 'f8'), ('v_min', 'f8'), ('tv_max', 'f8'), ('v_max', 'f8'),
+                          ('ts_min', 'f8'), ('s_min', 'f8'), ('ts_max', 'f8'), ('s_max', 'f8')])
+
+
+# (offset, number of blocks, samples per block) of every pyramid level of a run with n samples
+def pyramid_levels(n: int):
+
+    levels = []
+    offset = 0
+    count = -(-n//PYRAMID_BASE)
+    block = PYRAMID_BASE
+    while count > 0:
+        levels.append((offset, count, block))
+        if count == 1:
+            break
+        offset = offset + count
+        count = -(-count//PYRAMID_FACTOR)
+        block = block*PYRAMID_FACTOR
+    return levels
+
+
+# min / max (and their times) over groups of `size` consecutive entries, the last group may be shorter
+def _reduce(t_min, y_min, t_max, y_max, size: int):
+
+    n = len(y_min)
+    pad = -n % size
+    if pad:
+        t_min, y_min, t_max, y_max = [np.concatenate((x, np.repeat(x[-1:], pad)))
+                                      for x in (t_min, y_min, t_max, y_max)]
+    rows = np.arange(len(y_min)//size)*size
+    i_min = rows + y_min.reshape(-1, size).argmin(axis=1)
+    i_max = rows + y_max.reshape(-1, size).argmax(axis=1)
+    return t_min[i_min], y_min[i_min], t_max[i_max], y_max[i_max]
+
+
+def build_pyramid(ta, va, sa):
+
+    levels = pyramid_levels(len(ta))
+    pyramid = np.empty(sum(count for offset, count, block in levels), dtype=PYRAMID_DTYPE)
+    v = (ta, va, ta, va)
+    s = (ta, sa, ta, sa)
+    size = PYRAMID_BASE
+    for offset, count, block in levels:
+        v = _reduce(*v, size)
+        s = _reduce(*s, size)
+        rows = pyramid[offset:offset + count]
+        rows['tv_min'], rows['v_min'], rows['tv_max'], rows['v_max'] = v
+        rows['ts_min'], rows['s_min'], rows['ts_max'], rows['s_max'] = s
+        size = PYRAMID_FACTOR
+    return pyramid
+
+
+class TrajectoryArchive:
+
+    # mode 'r' opens an existing archive read-only, 'a' opens or creates it for appending
+    def __init__(self, path: str, mode='r', dtype=np.float64):
+
+        self.path = path
+        self.mode = mode
+        meta_path = os.path.join(path, 'archive.json')
+        if mode == 'a' and not os.path.exists(meta_path):
+            os.makedirs(path, exist_ok=True)
+            with open(meta_path, 'w') as f:
+                json.dump({'version': ARCHIVE_VERSION, 'dtype': np.dtype(dtype).str,
+                           'pyramid_base': PYRAMID_BASE, 'pyramid_factor': PYRAMID_FACTOR}, f)
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if (meta['version'] != ARCHIVE_VERSION or meta['pyramid_base'] != PYRAMID_BASE
+                or meta['pyramid_factor'] != PYRAMID_FACTOR):
+            raise ValueError('Unsupported trajectory archive format in %s' % path)
+        self.dtype = np.dtype(meta['dtype'])
+
+        self.files = None
+        self.maps = None
+        self.n_runs = os.path.getsize(self.file_path('index')) // TRAJ_INDEX_DTYPE.itemsize \
+            if os.path.exists(self.file_path('index')) else 0
+        if mode == 'a':
+            self.open_for_append()
+
+    def file_path(self, name: str) -> str:
+        return os.path.join(self.path, name + '.bin')
+
+    # cut off anything written after the last committed run and keep the files open for appending
+    def open_for_append(self):
+
+        index = self.read_index()
+        n_samples = int(index['offset'][-1] + index['n'][-1]) if len(index) else 0
+        n_pyramid = int(index['pyramid_offset'][-1] + index['n_pyramid'][-1]) if len(index) else 0
+        # release the map before truncating (Windows refuses to resize mapped files)
+        del index
+        sizes = {'index': self.n_runs*TRAJ_INDEX_DTYPE.itemsize, 'pyramid': n_pyramid*PYRAMID_DTYPE.itemsize}
+        for name in COLUMNS:
+            sizes[name] = n_samples*self.dtype.itemsize
+        self.files = {}
+        for name, size in sizes.items():
+            f = open(self.file_path(name), 'ab')
+            f.truncate(size)
+            self.files[name] = f
+        self.n_samples = n_samples
+        self.n_pyramid = n_pyramid
+
+    # memory map of the committed index records, only the pages of the records used are read
+    def read_index(self):
+
+        if self.n_runs == 0:
+            return np.zeros(0, dtype=TRAJ_INDEX_DTYPE)
+        return np.memmap(self.file_path('index'), dtype=TRAJ_INDEX_DTYPE, mode='r', shape=(self.n_runs,))
+
+    def __len__(self):
+        return self.n_runs
+
+    # Append one run, returns its number. params: dict with the BATCH_INPUTS of the run (missing ones are nan).
+    def append(self, ta, va, sa, params=None, status=RampRoll.STATUS_STOPPED) -> int:
+
+        if self.files is None:
+            raise ValueError('Trajectory archive %s is open read-only' % self.path)
+        columns = [np.ascontiguousarray(x, dtype=self.dtype) for x in (ta, va, sa)]
+        n = len(columns[0])
+        pyramid = build_pyramid(*columns) if n else np.zeros(0, dtype=PYRAMID_DTYPE)
+
+        record = np.zeros(1, dtype=TRAJ_INDEX_DTYPE)
+        record['offset'] = self.n_samples
+        record['n'] = n
+        record['pyramid_offset'] = self.n_pyramid
+        record['n_pyramid'] = len(pyramid)
+        for name in RampRoll.BATCH_INPUTS:
+            record[name] = np.nan if params is None else params.get(name, np.nan)
+        record['distance'] = columns[2][-1] if n else np.nan
+        record['status'] = status
+
+        for name, x in zip(COLUMNS, columns):
+            self.files[name].write(x.tobytes())
+        self.files['pyramid'].write(pyramid.tobytes())
+        for name in COLUMNS + ('pyramid',):
+            self.files[name].flush()
+        self.files['index'].write(record.tobytes())
+        self.files['index'].flush()
+
+        self.n_samples = self.n_samples + n
+        self.n_pyramid = self.n_pyramid + len(pyramid)
+        self.n_runs = self.n_runs + 1
+        self.maps = None
+        return self.n_runs - 1
+
+    # pick up runs appended by another process (read-only archives)
+    def refresh(self):
+
+        n_runs = os.path.getsize(self.file_path('index')) // TRAJ_INDEX_DTYPE.itemsize
+        if n_runs != self.n_runs:
+            self.n_runs = n_runs
+            self.maps = None
+
+    def close(self):
+
+        if self.files is not None:
+            for f in self.files.values():
+                f.close()
+            self.files = None
+        self.maps = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # memory maps of the committed part of every file, rebuilt after appends
+    def mapped(self) -> dict:
+
+        if self.maps is None:
+            maps = {'index': self.read_index()}
+            index = maps['index']
+            n_samples = int(index['offset'][-1] + index['n'][-1]) if len(index) else 0
+            n_pyramid = int(index['pyramid_offset'][-1] + index['n_pyramid'][-1]) if len(index) else 0
+            for name in COLUMNS:
+                maps[name] = np.memmap(self.file_path(name), dtype=self.dtype, mode='r', shape=(n_samples,)) \
+                    if n_samples else np.zeros(0, dtype=self.dtype)
+            maps['pyramid'] = np.memmap(self.file_path('pyramid'), dtype=PYRAMID_DTYPE, mode='r',
+                                        shape=(n_pyramid,)) if n_pyramid else np.zeros(0, dtype=PYRAMID_DTYPE)
+            self.maps = maps
+        return self.maps
+
+    @property
+    def index(self):
+        return self.mapped()['index']
+
+    # zero-copy (ta, va, sa) views of run i, pages are only read when touched
+    def run(self, i: int):
+
+        maps = self.mapped()
+        record = maps['index'][i]
+        lo = int(record['offset'])
+        hi = lo + int(record['n'])
+        return maps['t'][lo:hi], maps['v'][lo:hi], maps['s'][lo:hi]
+
+    def pyramid(self, i: int):
+
+        maps = self.mapped()
+        record = maps['index'][i]
+        lo = int(record['pyramid_offset'])
+        return maps['pyramid'][lo:lo + int(record['n_pyramid'])]
+
+    # (t_first, t_last, v_min, v_max, s_min, s_max) of run i from the top pyramid level
+    def extent(self, i: int):
+
+        ta, va, sa = self.run(i)
+        if len(ta) == 0:
+            return 0., 0., 0., 0., 0., 0.
+        top = self.pyramid(i)[-1]
+        return (float(ta[0]), float(ta[-1]), float(top['v_min']), float(top['v_max']),
+                float(top['s_min']), float(top['s_max']))
+
+    # The part of run i between t_lo and t_hi (plus one sample on each side) for a plot n_pixels wide:
+    # ((tv, v), (ts, s)) with the raw samples when there are few of them, otherwise the min / max points of
+    # the coarsest pyramid level that still has at least n_pixels blocks in the window, in time order.
+    def window(self, i: int, t_lo: float, t_hi: float, n_pixels: int):
+
+        ta, va, sa = self.run(i)
+        i_lo = max(int(np.searchsorted(ta, t_lo, side='left')) - 1, 0)
+        i_hi = min(int(np.searchsorted(ta, t_hi, side='right')) + 1, len(ta))
+        count = i_hi - i_lo
+        levels = [level for level in pyramid_levels(len(ta)) if level[2]*max(n_pixels, 1) <= count]
+        if count <= 2*n_pixels or not levels:
+            t = np.array(ta[i_lo:i_hi])
+            return (t, np.array(va[i_lo:i_hi])), (t, np.array(sa[i_lo:i_hi]))
+
+        offset, n_blocks, block = levels[-1]
+        rows = np.array(self.pyramid(i)[offset + i_lo//block:offset + -(-i_hi//block)])
+        result = []
+        for name in ('v', 's'):
+            t = np.concatenate((rows['t%s_min' % name], rows['t%s_max' % name]))
+            y = np.concatenate((rows['%s_min' % name], rows['%s_max' % name]))
+            order = np.argsort(t, kind='stable')
+            t = t[order]
+            y = y[order]
+            keep = np.concatenate(([True], np.diff(t) > 0))
+            result.append((t[keep], y[keep]))
+        return tuple(result)